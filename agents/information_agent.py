@@ -2,6 +2,7 @@ import os
 import sys
 import json
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import googlemaps
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
@@ -16,6 +17,48 @@ from services.maps_api import POIApi
 from services.weather_api import WeatherService
 from services.car_rental_api import CarRentalService
 from services.fuel_price_api import get_gas_price
+from utils import TTLCache
+
+# Google place type -> cuisine label, in the order labels are listed
+CUISINE_BY_PLACE_TYPE = (
+    ('chinese_restaurant', 'Chinese'),
+    ('japanese_restaurant', 'Japanese'),
+    ('italian_restaurant', 'Italian'),
+    ('french_restaurant', 'French'),
+)
+
+# City name -> coordinates, shared by every InformationAgent; city centres don't move
+_geocode_cache = TTLCache(maxsize=1024, ttl=7 * 24 * 3600)
+
+# User fields that can change an attraction ranking; the rest (name, start date, rental flag, ...)
+# is left out of both the rerank prompt and its cache key so that it can't cause a cache miss
+RANKING_PREF_KEYS = ("city", "days", "budget", "people", "kids", "health", "hobbies", "specificRequirements")
+
+# Rerank results, shared across sessions: same candidates + preferences + weather -> same ranking
+_llm_rerank_cache = TTLCache(maxsize=512, ttl=6 * 3600)
+
+# Forecast digest -> LLM weather summary; same forecast data means the same summary
+_weather_summary_cache = TTLCache(maxsize=256, ttl=3600)
+
+# (pickup coordinates, dates, driver age) -> car offers from the rental API; prices move, so keep them briefly
+_car_rental_cache = TTLCache(maxsize=256, ttl=15 * 60)
+
+# City -> fuel price in USD per gallon; the country-level price data changes rarely
+_fuel_price_cache = TTLCache(maxsize=512, ttl=24 * 3600)
+
+# Typical visit length in hours per Google place category
+CATEGORY_DURATION_HOURS = {
+    'restaurant': 2,
+    'museum': 2,
+    'park': 2,
+    'tourist_attraction': 2,
+    'night_club': 3,
+    'shopping_mall': 3,
+    'zoo': 3,
+    'amusement_park': 6
+}
+# Default duration if category is not found
+DEFAULT_DURATION_HOURS = 2
 
 def format_duration(seconds):
     """Format duration in seconds to a human-readable string (hours and minutes)."""
@@ -50,8 +93,8 @@ class InformationAgent:
         if not self.maps_api_key:
             raise ValueError("MAPS_API_KEY is required for InformationAgent.")
 
-        self.gmaps = googlemaps.Client(key=self.maps_api_key)
         self.poi_api = POIApi(self.maps_api_key)
+        self.gmaps = self.poi_api.gmaps # same shared client as POIApi
         self.weather_service = WeatherService()
         self.car_rental_service = None
         if self.rapidapi_key and self.rapidapi_key != "YOUR_RAPIDAPI_KEY" and len(self.rapidapi_key) >= 30:
@@ -70,15 +113,14 @@ class InformationAgent:
             self.llm = None
 
         self.weather_summary_writer = self.llm 
-        self.llm_rerank_cache = {}
+        self.llm_rerank_cache = _llm_rerank_cache
 
     def _get_rerank_cache_key(self, user_prefs, attractions_ids_tuple, weather_summary):
         """Generate a cache key for LLM re-ranking based on user preferences, attraction IDs, and weather."""
-        prefs_str = json.dumps(user_prefs, sort_keys=True)
-        ids_str = json.dumps(attractions_ids_tuple, sort_keys=True)
-        weather_str = weather_summary if weather_summary else ""
-        hash_object = hashlib.sha256(f"{prefs_str}-{ids_str}-{weather_str}".encode())
-        return hash_object.hexdigest()
+        # One canonical serialization, hashed to a fixed 32-char key
+        payload = json.dumps([user_prefs, attractions_ids_tuple, weather_summary or ""],
+                             sort_keys=True, separators=(",", ":"))
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
 
     def _create_llm_rerank_prompt(self, user_prefs, attractions_for_llm, weather_summary):
         """Create a prompt for the LLM to re-rank attractions."""
@@ -86,23 +128,16 @@ class InformationAgent:
         user_prefs_str = json.dumps(user_prefs, indent=2, ensure_ascii=False)
         weather_str = weather_summary if weather_summary else "No specific weather summary provided."
 
+        # Layout for the provider's automatic prefix caching: fixed instructions first, then the
+        # candidate list (identical for every session in the same city), and the per-user parts last
         prompt = f"""
         You are an expert travel recommender. Your task is to rank the provided list of attractions based on the user's preferences, the details of each attraction, and the current weather summary.
 
-        User Preferences:
-        {user_prefs_str}
-
-        Weather Summary for the trip period:
-        {weather_str}
-
-        Attractions List (with details including their original 'id', 'name', 'category', 'estimated_duration', 'price_level', 'rating', and a brief 'description' if available):
-        {attractions_str}
-
         Please consider the following factors for ranking:
-        1.  **User Hobbies & Interests**: Match with user's hobbies (e.g., '{user_prefs.get('hobbies', 'general sightseeing')}').
-        2.  **User Health & Accessibility**: Consider user's health (e.g., '{user_prefs.get('health', 'good')}') and attraction accessibility.
-        3.  **Suitability for Children**: If traveling with kids (e.g., Kids: '{user_prefs.get('kids', 'no')}'), prioritize child-friendly options.
-        4.  **Budget Constraints**: Align with budget (e.g., '{user_prefs.get('budget', 'medium')}').
+        1.  **User Hobbies & Interests**: Match with the user's hobbies (general sightseeing if none are given).
+        2.  **User Health & Accessibility**: Consider the user's health and attraction accessibility.
+        3.  **Suitability for Children**: If traveling with kids, prioritize child-friendly options.
+        4.  **Budget Constraints**: Align with the user's budget (medium if not given).
         5.  **Weather Impact**: Prioritize indoor/outdoor activities based on the weather.
         6.  **Category Balance**: Aim for diversity in top recommendations. Also filter out duplicate attractions that are essentially the same place but listed differently.
 
@@ -110,6 +145,15 @@ class InformationAgent:
         The output MUST be a valid JSON list of strings (attraction IDs). For example:
         ["id1", "id2", "id3"]
 
+        Attractions List (with details including their original 'id', 'name', 'category', 'estimated_duration', 'price_level', 'rating', and a brief 'description' if available):
+        {attractions_str}
+
+        User Preferences:
+        {user_prefs_str}
+
+        Weather Summary for the trip period:
+        {weather_str}
+
         Only return the JSON list of IDs. Do not include any other text or explanation.
         """
         return prompt
@@ -125,6 +169,7 @@ class InformationAgent:
              print("User preferences not provided for LLM re-ranking. Returning original list.")
              return attractions_list
 
+        user_prefs = {k: user_prefs[k] for k in RANKING_PREF_KEYS if k in user_prefs}
         attractions_for_llm = []
         for attr in attractions_list:
             attractions_for_llm.append({
@@ -137,9 +182,9 @@ class InformationAgent:
         attraction_ids_tuple = tuple(sorted([attr.get('id', '') for attr in attractions_for_llm]))
         cache_key = self._get_rerank_cache_key(user_prefs, attraction_ids_tuple, weather_summary)
 
-        if cache_key in self.llm_rerank_cache:
+        ranked_ids = self.llm_rerank_cache.get(cache_key)
+        if ranked_ids is not None:
             print(f"Returning cached LLM re-ranking for key: {cache_key}")
-            ranked_ids = self.llm_rerank_cache[cache_key]
         else:
             prompt_str = self._create_llm_rerank_prompt(user_prefs, attractions_for_llm, weather_summary)
             messages = [
@@ -193,10 +238,16 @@ class InformationAgent:
 
     def city2geocode(self, city: str):
         """Convert city name to geographic coordinates (latitude and longitude)."""
+        key = (self.maps_api_key, city.strip().casefold() if isinstance(city, str) else city)
+        cached = _geocode_cache.get(key)
+        if cached is not None:
+            return dict(cached)
         try:
             coordinates = self.gmaps.geocode(city)
             if not coordinates: return None
-            return coordinates[0]['geometry']['location']
+            location = coordinates[0]['geometry']['location']
+            _geocode_cache.set(key, location) # only successful lookups are cached
+            return dict(location)
         except Exception as e:
             print(f"Error in city2geocode for '{city}': {e}")
             return None
@@ -207,6 +258,15 @@ class InformationAgent:
                         sort_by: str = "rating", 
                         radius: int = 10000):
         """Get a list of attractions for a given location, ranked by LLM based on user preferences and weather."""
+        candidates = self.fetch_attraction_candidates(lat, lng, poi_type=poi_type, sort_by=sort_by, radius=radius)
+        return self.rank_attractions(candidates, user_prefs, weather_summary, number=number)
+
+    def fetch_attraction_candidates(self, lat: float, lng: float,
+                                    poi_type: str = "tourist_attraction", 
+                                    sort_by: str = "rating", 
+                                    radius: int = 10000):
+        """First stage of get_attractions: nearby places with details, sorted but not yet LLM-ranked.
+        Needs no weather or preferences, so it can run while those are being gathered."""
         location = (lat, lng)
         initial_fetch_limit = 30 # Fetch more initially to allow for better LLM ranking
         
@@ -245,11 +305,9 @@ class InformationAgent:
                 primary_category_from_place = place_types_list[0] if place_types_list else "unknown"
 
                 # Get photo references directly from the 'place' object
-                photo_references_from_place = []
-                if place.get('photos'):
-                    for photo_info_nearby in place['photos'][:1]: # Get first photo reference
-                         if photo_info_nearby.get('photo_reference'):
-                            photo_references_from_place.append(photo_info_nearby['photo_reference'])
+                photo_references_from_place = [
+                    ref for ref in (p.get('photo_reference') for p in (place.get('photos') or [])[:1]) if ref
+                ] # Get first photo reference
                 
                 # Fetch details, excluding 'types' and 'photos' from fields
                 details_response = self.poi_api.get_poi_details(
@@ -313,6 +371,12 @@ class InformationAgent:
             initial_pois.sort(key=lambda x: (x.get('price_level') is None, x.get('price_level', float('inf'))))
         elif sort_by == 'rating':
             initial_pois.sort(key=lambda x: (x.get('rating') is None, -(float(x.get('rating', 0.0) or 0.0))))
+        return initial_pois
+
+    def rank_attractions(self, initial_pois: list, user_prefs: dict, weather_summary: str = None, number: int = 20):
+        """Second stage of get_attractions: LLM re-rank for the user and weather, then keep the top `number`."""
+        if not initial_pois:
+            return []
 
         if user_prefs and self.llm:
             print(f"[INFO_AGENT] Re-ranking {len(initial_pois)} attractions with LLM.")
@@ -327,23 +391,8 @@ class InformationAgent:
         Estimate the duration for a given category and details.
         Returns duration in hours.
         """
-        category_duration = {
-            'restaurant': 2,
-            'museum': 2,
-            'park': 2,
-            'tourist_attraction': 2,
-            'night_club': 3,
-            'shopping_mall': 3,
-            'zoo': 3,
-            'amusement_park': 6
-        }
-        
-
-        # Default duration if category is not found
-        default_duration = 2
-        
         # Get duration based on category
-        duration = category_duration.get(category, default_duration)
+        duration = CATEGORY_DURATION_HOURS.get(category, DEFAULT_DURATION_HOURS)
         
         # Adjust duration based on rating
         rating = details.get('rating', 0)
@@ -378,47 +427,52 @@ class InformationAgent:
             ]
         """
         modes = ['driving', 'walking', 'bicycling', 'transit']
-        routes = []
-        for mode in modes:
-            try:
-                # Using 'en' for consistent address resolution and international compatibility
-                directions = self.gmaps.directions(
-                    origin, destination, mode=mode, language='en'
-                )
-                if not directions:
-                    continue
+        # The four Directions requests are independent, so issue them concurrently
+        with ThreadPoolExecutor(max_workers=len(modes)) as pool:
+            results = pool.map(lambda mode: self._plan_route_for_mode(origin, destination, mode), modes)
+        return [info for info in results if info is not None]
 
-                # Ensure legs exist and are not empty
-                if not directions[0].get('legs'):
-                    print(f"Warning: Route for mode '{mode}' from '{origin}' to '{destination}' lacks 'legs' data.")
-                    continue
-                leg = directions[0]['legs'][0]
-
-                # Ensure distance and duration exist in the leg
-                if 'distance' not in leg or 'duration' not in leg:
-                     print(f"Warning: Leg for mode '{mode}' from '{origin}' to '{destination}' lacks distance or duration data.")
-                     continue
-
-                info = {
-                    'mode': mode,
-                    'distance': leg['distance']['text'],
-                    'duration': leg['duration']['text'],
-                    'distance_meters': leg['distance']['value'], # Raw distance in meters
-                    'duration_seconds': leg['duration']['value']  # Raw duration in seconds
-                }
-                # Add fare info if available
-                if 'fare' in directions[0]:
-                    info['fare'] = directions[0]['fare'].get('text')
-                routes.append(info)
-            except googlemaps.exceptions.ApiError as e:
-                 print(f"Error planning route for mode '{mode}' from '{origin}' to '{destination}': {e}")
-            except IndexError:
-                 print(f"Index error processing route result for mode '{mode}' from '{origin}' to '{destination}' (likely missing 'legs').")
-            except KeyError as e:
-                 print(f"Key error processing route result for mode '{mode}' from '{origin}' to '{destination}': {e} (likely missing 'distance' or 'duration').")
-            except Exception as e:
-                 print(f"An unexpected error occurred during route planning for mode '{mode}': {e}")
-        return routes
+    def _plan_route_for_mode(self, origin, destination, mode):
+        """Fetch and summarize a single-mode route for plan_routes; returns None if unavailable."""
+        try:
+            # Using 'en' for consistent address resolution and international compatibility
+            directions = self.gmaps.directions(
+                origin, destination, mode=mode, language='en'
+            )
+            if not directions:
+                return None
+
+            # Ensure legs exist and are not empty
+            if not directions[0].get('legs'):
+                print(f"Warning: Route for mode '{mode}' from '{origin}' to '{destination}' lacks 'legs' data.")
+                return None
+            leg = directions[0]['legs'][0]
+
+            # Ensure distance and duration exist in the leg
+            if 'distance' not in leg or 'duration' not in leg:
+                 print(f"Warning: Leg for mode '{mode}' from '{origin}' to '{destination}' lacks distance or duration data.")
+                 return None
+
+            info = {
+                'mode': mode,
+                'distance': leg['distance']['text'],
+                'duration': leg['duration']['text'],
+                'distance_meters': leg['distance']['value'], # Raw distance in meters
+                'duration_seconds': leg['duration']['value']  # Raw duration in seconds
+            }
+            # Add fare info if available
+            if 'fare' in directions[0]:
+                info['fare'] = directions[0]['fare'].get('text')
+            return info
+        except googlemaps.exceptions.ApiError as e:
+             print(f"Error planning route for mode '{mode}' from '{origin}' to '{destination}': {e}")
+        except IndexError:
+             print(f"Index error processing route result for mode '{mode}' from '{origin}' to '{destination}' (likely missing 'legs').")
+        except KeyError as e:
+             print(f"Key error processing route result for mode '{mode}' from '{origin}' to '{destination}': {e} (likely missing 'distance' or 'duration').")
+        except Exception as e:
+             print(f"An unexpected error occurred during route planning for mode '{mode}': {e}")
+        return None
 
     def plan_with_waypoints(self, origin: str, destination: str, waypoints: list,
                                             mode: str = 'driving', departure_time: datetime = None):
@@ -502,18 +556,22 @@ class InformationAgent:
             # 'legs' are the segments between points (origin->wpt1, wpt1->wpt2, ..., wptN->dest)
             legs = route['legs']
 
-            # Calculate total duration and distance by summing up values from each leg
-            total_duration_sec = sum(leg['duration']['value'] for leg in legs)
-            total_distance_m = sum(leg['distance']['value'] for leg in legs)
-
-            # Calculate duration with traffic if available for all legs
-            total_duration_traffic_sec = None
-            if all('duration_in_traffic' in leg for leg in legs):
-                 total_duration_traffic_sec = sum(leg['duration_in_traffic']['value'] for leg in legs)
-
-            # Reconstruct the path sequence using resolved addresses from the API response
+            # One pass over the legs: sum duration/distance (and traffic duration when every
+            # leg has it) and reconstruct the path sequence from the resolved addresses.
             # Start address is from the first leg; end addresses are from each leg
-            path_sequence = [legs[0]['start_address']] + [leg['end_address'] for leg in legs]
+            total_duration_sec = total_distance_m = traffic_sec = 0
+            has_traffic = True
+            path_sequence = [legs[0]['start_address']]
+            for leg in legs:
+                total_duration_sec += leg['duration']['value']
+                total_distance_m += leg['distance']['value']
+                in_traffic = leg.get('duration_in_traffic')
+                if in_traffic is None:
+                    has_traffic = False
+                elif has_traffic:
+                    traffic_sec += in_traffic['value']
+                path_sequence.append(leg['end_address'])
+            total_duration_traffic_sec = traffic_sec if has_traffic else None
 
             # Get the optimized order of the *original* waypoints list (0-based indices)
             optimized_indices = route.get('waypoint_order', [])
@@ -612,8 +670,13 @@ class InformationAgent:
                 HumanMessage(content=prompt)
             ]
             
-            # Add the summary to the result
-            result['summary'] = self.weather_summary_writer.invoke(messages)
+            # Add the summary to the result (only ask the LLM for forecasts we haven't summarized lately)
+            cache_key = hashlib.blake2b(weather_info.encode(), digest_size=16).hexdigest()
+            weather_summary = _weather_summary_cache.get(cache_key)
+            if weather_summary is None:
+                weather_summary = self.weather_summary_writer.invoke(messages)
+                _weather_summary_cache[cache_key] = weather_summary
+            result['summary'] = weather_summary
         
         return result
             
@@ -650,6 +713,11 @@ class InformationAgent:
                 ...
             ]
         """
+        # Without a configured rental service the result is always mock data;
+        # return it before spending a geocode request on the location
+        if self.car_rental_service is None:
+            return self._get_mock_car_data(top_n)
+
         try:
             # Get location coordinates
             location_data = self.city2geocode(location)
@@ -666,19 +734,24 @@ class InformationAgent:
             dropoff_date = dropoff_date_obj.strftime("%Y-%m-%d")
             dropoff_time = "10:00:00"  # Default dropoff time
             
-            # Call the car rental service
-            cars = self.car_rental_service.find_available_cars(
-                pickup_lat=location_data['lat'],
-                pickup_lon=location_data['lng'],
-                pickup_date=pickup_date,
-                pickup_time=pickup_time,
-                dropoff_lat=location_data['lat'],
-                dropoff_lon=location_data['lng'],
-                dropoff_date=dropoff_date,
-                dropoff_time=dropoff_time,
-                currency_code="USD",
-                driver_age=driver_age,
-            )
+            # Call the car rental service (unless the same search ran recently)
+            cache_key = (location_data['lat'], location_data['lng'], pickup_date, dropoff_date, driver_age)
+            cars = _car_rental_cache.get(cache_key)
+            if cars is None:
+                cars = self.car_rental_service.find_available_cars(
+                    pickup_lat=location_data['lat'],
+                    pickup_lon=location_data['lng'],
+                    pickup_date=pickup_date,
+                    pickup_time=pickup_time,
+                    dropoff_lat=location_data['lat'],
+                    dropoff_lon=location_data['lng'],
+                    dropoff_date=dropoff_date,
+                    dropoff_time=dropoff_time,
+                    currency_code="USD",
+                    driver_age=driver_age,
+                )
+                if cars:
+                    _car_rental_cache[cache_key] = cars # empty/failed searches fall back to mock data, don't cache those
             
             # Filter by price if needed
             if cars and min_price is not None:
@@ -773,8 +846,7 @@ class InformationAgent:
             processed_restaurants = []
             # Sort all fetched restaurants by rating (descending) before further processing
             # Handle cases where rating might be missing by defaulting to 0 for sorting
-            all_fetched_restaurants = restaurants_result.get('results', [])
-            all_fetched_restaurants.sort(key=lambda p: p.get('rating', 0), reverse=True)
+            all_fetched_restaurants = sorted(restaurants_result.get('results', []), key=lambda p: p.get('rating', 0), reverse=True)
 
             for place in all_fetched_restaurants[:3]:  # Only take the top 3 after sorting
                 try:
@@ -790,15 +862,15 @@ class InformationAgent:
                     place_details = place_details['result']
                     
                     # Get photos
-                    photos = []
-                    if 'photos' in place:  # Get photo info from the original search result
-                        for photo in place['photos'][:3]:  # Up to 3 photos
-                            photo_url = f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=800&photoreference={photo['photo_reference']}&key={self.maps_api_key}"
-                            photos.append({
-                                'url': photo_url,
-                                'width': photo.get('width', 800),
-                                'height': photo.get('height', 600)
-                            })
+                    # Get photo info from the original search result, up to 3 photos
+                    photos = [
+                        {
+                            'url': f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=800&photoreference={photo['photo_reference']}&key={self.maps_api_key}",
+                            'width': photo.get('width', 800),
+                            'height': photo.get('height', 600)
+                        }
+                        for photo in place.get('photos', [])[:3]
+                    ]
                     
                     restaurant = {
                         'name': place_details.get('name', 'Unknown Restaurant'),
@@ -843,16 +915,8 @@ class InformationAgent:
     
     def _get_restaurant_features(self, place):
         """Get restaurant features (cuisine types) from place types."""
-        features = []
-        if 'types' in place:
-            if 'chinese_restaurant' in place['types']:
-                features.append('Chinese')
-            if 'japanese_restaurant' in place['types']:
-                features.append('Japanese')
-            if 'italian_restaurant' in place['types']:
-                features.append('Italian')
-            if 'french_restaurant' in place['types']:
-                features.append('French')
+        types = set(place.get('types', ()))
+        features = [label for place_type, label in CUISINE_BY_PLACE_TYPE if place_type in types]
         return ', '.join(features) if features else 'Cuisine'
 
     def get_fuel_price(self, location: str):
@@ -865,8 +929,15 @@ class InformationAgent:
         Returns:
             float: Fuel price in USD per gallon, or None if not found.
         """
+        key = location.strip().casefold()
+        price = _fuel_price_cache.get(key)
+        if price is not None:
+            return price
         try:
-            return get_gas_price(location)
+            price = get_gas_price(location)
+            if price is not None:
+                _fuel_price_cache[key] = price
+            return price
         except Exception as e:
             print(f"Error getting fuel prices: {str(e)}")
             return None
@@ -3,6 +3,7 @@ import math
 import json
 from datetime import datetime, timedelta
 import networkx as nx
+import numpy as np
 from utils import ask_openai, extract_number
 import re
 import sys
@@ -12,16 +13,64 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from agents.information_agent import InformationAgent
 
+EARTH_RADIUS_KM = 6371
+
+def haversine_km(lats1, lons1, lats2, lons2):
+    """Great-circle distance in km; accepts scalars or broadcastable arrays of degrees."""
+    lats1, lons1, lats2, lons2 = map(np.radians, (lats1, lons1, lats2, lons2))
+    a = np.sin((lats2 - lats1) / 2) ** 2 + np.cos(lats1) * np.cos(lats2) * np.sin((lons2 - lons1) / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(a))
+
+# Base daily costs per person, by budget level
+BASE_DAILY_COSTS = {
+    "low": {"accommodation": 50, "food": 30, "transport": 10},
+    "medium": {"accommodation": 100, "food": 60, "transport": 20},
+    "high": {"accommodation": 200, "food": 100, "transport": 40}
+}
+
+# Attraction entry cost per person by Google price level
+PRICE_LEVEL_COST = {0: 0, 1: 10, 2: 20, 3: 30, 4: 50}
+
+# Rental car assumptions by budget level
+FUEL_PROFILES = {
+    "low": {
+        "fuel_efficiency": 7.0,   # liters/100km
+        "car_type": "Economy"
+    },
+    "medium": {
+        "fuel_efficiency": 8.5,   # Slightly higher for mid-range cars
+        "car_type": "Mid-range"
+    },
+    "high": {
+        "fuel_efficiency": 10.0,  # Higher for luxury cars
+        "car_type": "Luxury"
+    }
+}
+
+def _haversine_scalar_km(lat1, lon1, lat2, lon2):
+    """Single-pair great-circle distance in km (plain math, no array overhead)."""
+    lat1, lon1, lat2, lon2 = math.radians(lat1), math.radians(lon1), math.radians(lat2), math.radians(lon2)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * math.asin(math.sqrt(a))
+
+try:
+    from numba import njit # Optional: compile the scalar kernel to machine code
+    _haversine_scalar_km = njit(cache=True)(_haversine_scalar_km)
+except ImportError:
+    pass
+
 class RouteAgent:
-    def __init__(self, api_key=None):
-        """Initialize RouteAgent with optional API key for distance calculations"""
+    def __init__(self, api_key=None, info_agent=None):
+        """Initialize RouteAgent with optional API key for distance calculations.
+        Pass an existing InformationAgent to share its API clients and connection pools."""
         self.api_key = api_key
         self.distances_cache = {}
-        self.info_agent = None
-        try:
-            self.info_agent = InformationAgent()
-        except Exception as e:
-            print(f"Error initializing InformationAgent in RouteAgent: {e}")
+        self.info_agent = info_agent
+        if self.info_agent is None:
+            try:
+                self.info_agent = InformationAgent()
+            except Exception as e:
+                print(f"Error initializing InformationAgent in RouteAgent: {e}")
     
     def optimize_daily_route(self, attractions_for_day):
         """
@@ -121,17 +170,23 @@ class RouteAgent:
     def _get_distance_matrix(self, spots):
         """Get distance matrix between all pairs of spots using Haversine formula."""
         n = len(spots)
-        matrix = [[0 for _ in range(n)] for _ in range(n)]
-        
-        # Fill the matrix with distances
-        for i in range(n):
-            for j in range(i+1, n):
-                # Get distance between spot i and spot j
-                distance = self._calculate_distance(spots[i], spots[j])
-                matrix[i][j] = distance
-                matrix[j][i] = distance  # Symmetric
-        
-        return matrix
+        coords = np.full((n, 2), np.nan)
+        for i, spot in enumerate(spots):
+            location = spot.get("location")
+            if location and location.get("lat") is not None and location.get("lng") is not None:
+                coords[i] = (location["lat"], location["lng"])
+        
+        # All pairs in one vectorized pass instead of n^2/2 scalar trig calls
+        lats, lngs = coords[:, 0], coords[:, 1]
+        matrix = haversine_km(lats[:, None], lngs[:, None], lats[None, :], lngs[None, :])
+        
+        # Spots without coordinates get the default distance of 1, as in _calculate_distance
+        missing = np.isnan(lats)
+        matrix[missing, :] = 1
+        matrix[:, missing] = 1
+        np.fill_diagonal(matrix, 0)
+        
+        return matrix.tolist()
     
     def _calculate_distance(self, spot1, spot2):
         """Calculate distance between two spots using coordinates"""
@@ -140,24 +195,14 @@ class RouteAgent:
             return 1  # Default distance if no location data
         
         # Check cache first
-        cache_key = f"{spot1['id']}_{spot2['id']}"
+        cache_key = (spot1['id'], spot2['id']) # tuple key: no string formatting per lookup
         if cache_key in self.distances_cache:
             return self.distances_cache[cache_key]
         
         lat1, lon1 = spot1["location"]["lat"], spot1["location"]["lng"]
         lat2, lon2 = spot2["location"]["lat"], spot2["location"]["lng"]
         
-        R = 6371  # Earth radius in km
-        
-        # Convert coordinates to radians
-        lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-        
-        # Haversine formula
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        distance = R * c
+        distance = _haversine_scalar_km(float(lat1), float(lon1), float(lat2), float(lon2))
         
         # Cache the result
         self.distances_cache[cache_key] = distance
@@ -167,16 +212,12 @@ class RouteAgent:
     def _solve_tsp_brute_force(self, spots, distance_matrix):
         """Solve TSP by trying all permutations (only for small problems)"""
         n = len(spots)
-        best_distance = float('inf')
-        best_order = list(range(n))
+        matrix = np.asarray(distance_matrix, dtype=float)
         
-        # Try all permutations
-        for perm in itertools.permutations(range(n)):
-            distance = sum(distance_matrix[perm[i]][perm[i+1]] for i in range(n-1))
-            
-            if distance < best_distance:
-                best_distance = distance
-                best_order = perm
+        # Score all permutations at once: (n! x n) index array, legs gathered by fancy indexing
+        perms = np.array(list(itertools.permutations(range(n))), dtype=np.intp)
+        distances = matrix[perms[:, :-1], perms[:, 1:]].sum(axis=1)
+        best_order = perms[np.argmin(distances)] # first minimum, same tie-break as a strict '<' scan
         
         # Return spots in optimal order
         return [spots[i] for i in best_order]
@@ -202,11 +243,13 @@ class RouteAgent:
         # Return spots in calculated order
         return [spots[i] for i in tour]
     
-    def format_daily_plan_to_itinerary(self, daily_plan_name_dict, all_spots_object_map, start_date_str):
-        """Generate daily itinerary based on a pre-defined daily plan of attraction names."""
+    def format_daily_plan_to_itinerary(self, daily_plan_name_dict, all_spots_object_map, start_date_str, route=None):
+        """Generate daily itinerary based on a pre-defined daily plan of attraction names.
+        If a route list is given, it is filled in the same pass with every spot in visiting order, tagged with its day."""
         itinerary = []
         try:
-            current_date = datetime.strptime(start_date_str, "%Y-%m-%d")
+            # Callers that already parsed the date may pass the datetime itself
+            current_date = start_date_str if isinstance(start_date_str, datetime) else datetime.fromisoformat(start_date_str)
         except ValueError:
             print(f"[ERROR] Invalid start_date_str format: {start_date_str}. Expected YYYY-MM-DD.")
             # Fallback to today if date is invalid, or handle error as preferred
@@ -254,12 +297,14 @@ class RouteAgent:
                 spot_with_time["start_time"] = f"{int(activity_start_hour):02d}:00"
                 spot_with_time["end_time"] = f"{int(activity_end_hour):02d}:00"
                 current_day_spots_timed.append(spot_with_time)
+                if route is not None:
+                    route.append({**spot_with_time, "day": day_number}) # own dict, so the itinerary's spot is untouched
                 
                 start_offset_hours += spot_duration # Next spot starts after this one
 
             itinerary.append({
                 "day": day_number,
-                "date": current_date.strftime("%Y-%m-%d"),
+                "date": current_date.date().isoformat(),
                 "spots": current_day_spots_timed
             })
             current_date += timedelta(days=1)
@@ -268,13 +313,6 @@ class RouteAgent:
 
     def estimate_budget(self, spots, user_prefs, should_rent_car=False, car_info=None, fuel_price=None):
         """Estimate budget for the selected attractions"""
-        # Base daily costs
-        base_costs = {
-            "low": {"accommodation": 50, "food": 30, "transport": 10},
-            "medium": {"accommodation": 100, "food": 60, "transport": 20},
-            "high": {"accommodation": 200, "food": 100, "transport": 40}
-        }
-        
         # Get budget level from user preferences
         budget_value = user_prefs.get("budget", "medium")
         
@@ -302,7 +340,7 @@ class RouteAgent:
         num_days = user_prefs.get("days", 1)
         
         # Calculate base costs
-        daily_cost = sum(base_costs[budget_level].values())
+        daily_cost = sum(BASE_DAILY_COSTS[budget_level].values())
         base_total = daily_cost * int(num_days) * int(num_people)
         
         # Add attraction costs
@@ -310,8 +348,7 @@ class RouteAgent:
         for spot in spots:
             price_level = spot.get("price_level", 2)
             # Convert price level to actual cost
-            cost_map = {0: 0, 1: 10, 2: 20, 3: 30, 4: 50}
-            attraction_cost += cost_map.get(price_level, 20) * int(num_people)
+            attraction_cost += PRICE_LEVEL_COST.get(price_level, 20) * int(num_people)
         
         # Calculate total
         total = base_total + attraction_cost
@@ -345,23 +382,8 @@ class RouteAgent:
             for i in range(len(route)-1):
                 total_distance += self._calculate_distance(route[i], route[i+1])
            
-            fuel_costs = {
-                "low": {
-                    "fuel_efficiency": 7.0,   # liters/100km
-                    "car_type": "Economy"
-                },
-                "medium": {
-                    "fuel_efficiency": 8.5,   # Slightly higher for mid-range cars
-                    "car_type": "Mid-range"
-                },
-                "high": {
-                    "fuel_efficiency": 10.0,  # Higher for luxury cars
-                    "car_type": "Luxury"
-                }
-            }
-        
             # Calculate fuel cost
-            fuel_info = fuel_costs[budget_level]
+            fuel_info = FUEL_PROFILES[budget_level]
             fuel_consumption = (total_distance * fuel_info["fuel_efficiency"]) / 100  # Total fuel consumption (liters)
             # Add check for None and use a default value if fuel_price is None
             if fuel_price is None:
@@ -374,9 +396,9 @@ class RouteAgent:
         # Return detailed budget
         return {
             "total": round(total, 2),
-            "accommodation": base_costs[budget_level]["accommodation"] * int(num_days) * int(num_people),
-            "food": base_costs[budget_level]["food"] * int(num_days) * int(num_people),
-            "transport": base_costs[budget_level]["transport"] * int(num_days) * int(num_people),
+            "accommodation": BASE_DAILY_COSTS[budget_level]["accommodation"] * int(num_days) * int(num_people),
+            "food": BASE_DAILY_COSTS[budget_level]["food"] * int(num_days) * int(num_people),
+            "transport": BASE_DAILY_COSTS[budget_level]["transport"] * int(num_days) * int(num_people),
             "attractions": attraction_cost,
             "car_rental": round(car_rental_cost, 2),
             "fuel_cost": round(fuel_cost, 2),
@@ -1,3 +1,4 @@
+import hashlib
 import math
 import random
 from langchain_openai import ChatOpenAI
@@ -5,23 +6,81 @@ from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from typing import Generator
 import utils
 import json
+import logging
 import re
 
+log = logging.getLogger(__name__)
+
+# Debug copy of plan_remaining_time's inputs (written only when DEBUG logging is on), replayed by "Test strategy.py"
+STRATEGY_INPUT_DUMP = "input of strategy.txt"
+
+# Prompt digest -> (cleaned recommendation text, should_rent_car); identical trip inputs
+# (repeat "confirm selection" clicks, or another session with the same plan) skip the LLM call
+_recommendation_cache = utils.TTLCache(maxsize=256, ttl=6 * 3600)
+# Planning-input digest -> (daily plan, planned attraction names) for validated plans only;
+# attraction objects are re-resolved from each caller's own list, so nothing is shared across sessions
+_plan_cache = utils.TTLCache(maxsize=256, ttl=6 * 3600)
+
+# The recommendation format puts the [car_rental:YES/NO] marker in its first section; read at most
+# this many characters of the stream looking for it before falling back to the whole text
+_CAR_RENTAL_MARKER_RE = re.compile(r'\[car_rental:(yes|no)\]', re.IGNORECASE)
+_MARKER_SEARCH_LIMIT = 600
+# Longest proper prefix of a marker that can end a streamed chunk, i.e. len("[car_rental:yes]") - 1
+_MARKER_CARRY = len("[car_rental:yes]") - 1
+
+# Clear positive indicators
+_POSITIVE_RENTAL_INDICATORS = (
+    "recommend renting a car",
+    "would recommend renting",
+    "recommend you rent",
+    "recommend renting",
+    "should rent a car",
+    "renting a car is recommended",
+    "car rental is recommended",
+    "i recommend a car rental",
+    "car rental would be beneficial",
+    "would benefit from renting",
+    "car would be helpful",
+)
+
+# Clear negative indicators
+_NEGATIVE_RENTAL_INDICATORS = (
+    "not recommend renting",
+    "don't recommend renting",
+    "do not recommend renting",
+    "wouldn't recommend renting",
+    "would not recommend renting",
+    "shouldn't rent a car",
+    "should not rent a car",
+    "no need to rent",
+    "no need for a car",
+    "renting a car is not recommended",
+    "car rental is not recommended",
+    "i do not recommend a car rental",
+    "without renting",
+    "without a car",
+)
+
+# One compiled alternation per list scans the section once instead of once per phrase
+_POSITIVE_RENTAL_RE = re.compile("|".join(map(re.escape, _POSITIVE_RENTAL_INDICATORS)))
+_NEGATIVE_RENTAL_RE = re.compile("|".join(map(re.escape, _NEGATIVE_RENTAL_INDICATORS)))
+
 class StrategyAgent:
     def __init__(self, model_name="gpt-4o"):
         """Initialize StrategyAgent with AI model for planning"""
         self.model = ChatOpenAI(model_name=model_name, temperature=0.7, streaming=True)
     
     def plan_remaining_time(self, selected_spots, total_days, all_attractions, user_prefs, weather_summary):
-        with open("input of strategy.txt", "w") as f: #for debug
-            json.dump({
+        if log.isEnabledFor(logging.DEBUG):
+            # For debug: snapshot the inputs now, write the file off the request thread
+            utils.write_text_in_background(STRATEGY_INPUT_DUMP, json.dumps({
                 "selected_spots": selected_spots,
                 "total_days": total_days,
                 "all_attractions": all_attractions,
                 "user_prefs": user_prefs,
                 "weather_summary": weather_summary
-            }, f, indent=4)
-        print("now in plan_remaining_time")
+            }, indent=4))
+        log.debug("now in plan_remaining_time")
         try:
             """Calculate remaining time and suggest additional attractions"""
             total_available_hours = int(total_days) * 8 # This seems to be unused if we get a full plan
@@ -62,7 +121,19 @@ class StrategyAgent:
                 Please consider these specific requirements when creating the itinerary.
                 """
 
-            for i in range(max_try):
+            # Same trip inputs (e.g. re-confirming an unchanged selection) -> reuse the validated plan
+            plan_key = hashlib.blake2b(
+                json.dumps([total_days, user_prefs_str, weather_str, selected_data, all_attractions_data], default=str).encode(),
+                digest_size=16,
+            ).hexdigest()
+            cached_plan = _plan_cache.get(plan_key)
+            if cached_plan is not None:
+                cached_daily_plan, cached_names = cached_plan
+                daily_plan_raw = {day: list(names) for day, names in cached_daily_plan.items()}
+                final_planned_attractions_names = list(cached_names)
+                log.debug("Using cached daily plan: %s", daily_plan_raw)
+
+            for i in range(max_try if cached_plan is None else 0):
                 prompt = f"""
                 You are a travel advisor helping with trip logistics.
                 The user is planning a {total_days}-day trip.
@@ -101,7 +172,7 @@ class StrategyAgent:
                 Ensure the output is a valid JSON object only.
                 """
                 result = utils.ask_openai(prompt)
-                print(f"Attempt {i+1} - Raw AI Output: {result}") # Debug raw output
+                log.debug("Attempt %d - Raw AI Output: %s", i + 1, result) # Debug raw output
                 
                 if result and 'answer' in result:
                     raw_answer = result['answer']
@@ -116,21 +187,21 @@ class StrategyAgent:
                                not all(isinstance(k, str) and k.startswith("day") and \
                                        isinstance(v, list) and all(isinstance(name, str) for name in v) \
                                        for k, v in daily_plan_raw.items()):
-                                print(f"Invalid JSON structure or non-string item in day's list: {daily_plan_raw}")
+                                log.warning("Invalid JSON structure or non-string item in day's list: %s", daily_plan_raw)
                                 daily_plan_raw = {} # Reset if structure is wrong
                                 continue
-                            print(f"Successfully parsed daily plan: {daily_plan_raw}")
+                            log.debug("Successfully parsed daily plan: %s", daily_plan_raw)
                         except json.JSONDecodeError as e:
-                            print(f"JSON parsing failed on attempt {i+1}: {e}")
-                            print(f"Problematic JSON string: {json_str}")
+                            log.warning("JSON parsing failed on attempt %d: %s", i + 1, e)
+                            log.debug("Problematic JSON string: %s", json_str)
                             daily_plan_raw = {}
                             continue # Try again if parsing fails
                     else:
-                        print(f"No JSON object found in AI response on attempt {i+1}: {raw_answer}")
+                        log.warning("No JSON object found in AI response on attempt %d: %s", i + 1, raw_answer)
                         daily_plan_raw = {}
                         continue
                 else:
-                    print(f"No answer from AI on attempt {i+1}")
+                    log.warning("No answer from AI on attempt %d", i + 1)
                     daily_plan_raw = {}
                     continue
 
@@ -144,19 +215,20 @@ class StrategyAgent:
                 valid_plan = True
                 for selected_spot_info in selected_data:
                     if selected_spot_info["name"] not in current_plan_attraction_names:
-                        print(f"Validation Failed: Selected spot '{selected_spot_info['name']}' not in the generated plan {current_plan_attraction_names}.")
+                        log.info("Validation Failed: Selected spot '%s' not in the generated plan %s.", selected_spot_info['name'], current_plan_attraction_names)
                         valid_plan = False
                         break
                 
                 if valid_plan:
                     final_planned_attractions_names = current_plan_attraction_names
-                    print(f"Valid plan found: {daily_plan_raw}")
+                    _plan_cache[plan_key] = ({day: list(names) for day, names in daily_plan_raw.items()}, list(final_planned_attractions_names))
+                    log.debug("Valid plan found: %s", daily_plan_raw)
                     break # Exit loop if a valid plan is found
                 else:
-                    print(f"Invalid plan on attempt {i+1}, retrying...")
+                    log.info("Invalid plan on attempt %d, retrying...", i + 1)
 
             if not final_planned_attractions_names: # If no valid plan after max_try
-                print("Failed to generate a valid plan after multiple attempts. Returning selected spots as fallback.")
+                log.warning("Failed to generate a valid plan after multiple attempts. Returning selected spots as fallback.")
                 # Fallback: use selected spots if planning fails, or handle error appropriately
                 additional_attractions_details = [spot for spot in selected_spots]
             else:
@@ -168,7 +240,7 @@ class StrategyAgent:
                     else:
                         # Handle case where a planned attraction name might not be in our initial list (e.g. slight name mismatch from LLM)
                         # For now, we'll just skip it, but ideally, we'd have fuzzy matching or a way to confirm
-                        print(f"Warning: Planned attraction '{name}' not found in the provided all_attractions list.")
+                        log.warning("Planned attraction '%s' not found in the provided all_attractions list.", name)
 
 
             # The function needs to return "additional_attractions" which is used later as the primary list of attractions.
@@ -178,10 +250,8 @@ class StrategyAgent:
                 "additional_attractions": additional_attractions_details, # This should be the flat list of all planned attractions.
                 "daily_plan": daily_plan_raw # Optionally return the structured daily plan if needed elsewhere
             }
-        except Exception as e:
-            print(f"Error in plan_remaining_time: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            log.exception("Error in plan_remaining_time")
             raise    
     def _suggest_additional_attractions(self, selected_spots, all_attractions, remaining_hours):
         """Suggest additional attractions based on remaining time"""
@@ -220,93 +290,59 @@ class StrategyAgent:
             original_text = recommendation_text
             recommendation_text = recommendation_text.lower()
             
-            print(f"[DEBUG] Analyzing rental recommendation from text: {recommendation_text[:200]}...")
+            log.debug("Analyzing rental recommendation from text: %.200s...", recommendation_text)
             
             # First, try to find a structured car rental marker if present
             structured_marker = re.search(r'\[car_rental:(yes|no)\]', recommendation_text, re.IGNORECASE)
             if structured_marker:
                 decision = structured_marker.group(1).lower()
                 should_rent = decision == 'yes'
-                print(f"[DEBUG] Found structured car rental marker: [{decision}], should_rent_car = {should_rent}")
+                log.debug("Found structured car rental marker: [%s], should_rent_car = %s", decision, should_rent)
                 return should_rent
             
             # Look for rental recommendation section
             car_rental_section_match = re.search(r'car rental recommendation:(.+?)(?=\n\n|\Z)', recommendation_text, re.DOTALL | re.IGNORECASE)
             if car_rental_section_match:
                 car_rental_section = car_rental_section_match.group(1).lower().strip()
-                print(f"[DEBUG] Found car rental section: {car_rental_section}")
+                log.debug("Found car rental section: %s", car_rental_section)
                 
                 # Look for decisive phrases first - these are the most reliable indicators
                 if car_rental_section.startswith("yes") or "i recommend renting" in car_rental_section:
-                    print("[DEBUG] Found explicit YES recommendation")
+                    log.debug("Found explicit YES recommendation")
                     return True
                     
                 if car_rental_section.startswith("no") or "i do not recommend" in car_rental_section or "i don't recommend" in car_rental_section:
-                    print("[DEBUG] Found explicit NO recommendation")
+                    log.debug("Found explicit NO recommendation")
                     return False
                 
-                # Clear positive indicators
-                positive_indicators = [
-                    "recommend renting a car",
-                    "would recommend renting",
-                    "recommend you rent",
-                    "recommend renting",
-                    "should rent a car",
-                    "renting a car is recommended",
-                    "car rental is recommended",
-                    "i recommend a car rental",
-                    "car rental would be beneficial",
-                    "would benefit from renting",
-                    "car would be helpful"
-                ]
-                
-                # Clear negative indicators
-                negative_indicators = [
-                    "not recommend renting",
-                    "don't recommend renting",
-                    "do not recommend renting",
-                    "wouldn't recommend renting",
-                    "would not recommend renting",
-                    "shouldn't rent a car",
-                    "should not rent a car",
-                    "no need to rent",
-                    "no need for a car",
-                    "renting a car is not recommended",
-                    "car rental is not recommended",
-                    "i do not recommend a car rental",
-                    "without renting",
-                    "without a car"
-                ]
-                
-                for indicator in positive_indicators:
-                    if indicator in car_rental_section:
-                        print(f"[DEBUG] Found positive indicator '{indicator}' - should rent car: TRUE")
-                        return True
-                        
-                for indicator in negative_indicators:
-                    if indicator in car_rental_section:
-                        print(f"[DEBUG] Found negative indicator '{indicator}' - should rent car: FALSE")
-                        return False
+                positive_match = _POSITIVE_RENTAL_RE.search(car_rental_section)
+                if positive_match:
+                    log.debug("Found positive indicator '%s' - should rent car: TRUE", positive_match.group(0))
+                    return True
+
+                negative_match = _NEGATIVE_RENTAL_RE.search(car_rental_section)
+                if negative_match:
+                    log.debug("Found negative indicator '%s' - should rent car: FALSE", negative_match.group(0))
+                    return False
             
             # Look for recommendation in the full text if section wasn't found or conclusive
             if "not recommend renting a car" in recommendation_text or "do not recommend renting a car" in recommendation_text:
-                print("[DEBUG] Found negative recommendation in full text - should rent car: FALSE")
+                log.debug("Found negative recommendation in full text - should rent car: FALSE")
                 return False
             elif "recommend renting a car" in recommendation_text:
-                print("[DEBUG] Found positive recommendation in full text - should rent car: TRUE")
+                log.debug("Found positive recommendation in full text - should rent car: TRUE")
                 return True
             
-            print(f"[CRITICAL] Could not determine car rental recommendation from text. Full original text: {original_text}")
-            print(f"[DEBUG] Defaulting to FALSE for safety")
+            log.warning("Could not determine car rental recommendation from text; defaulting to FALSE. Full original text: %s", original_text)
             return False
             
         except Exception as e:
-            print(f"[ERROR] Error analyzing recommendation: {e}")
+            log.error("Error analyzing recommendation: %s", e)
             return False
     
     def get_ai_recommendation(self, user_prefs, selected_spots, total_days, user_name=None) -> Generator:
         """Get AI recommendation about the overall trip plan"""
-        print(f"[DEBUG] Received user_prefs in get_ai_recommendation: {user_prefs}")  # Debug log
+        log.debug("Received user_prefs in get_ai_recommendation: %s", user_prefs)
         
         # Create prompt for the LLM
         name = user_name if user_name else "Traveler"
@@ -366,29 +402,70 @@ class StrategyAgent:
         ]
         
         try:
-            # Get the full response first to analyze it
-            response = self.model(messages)
-            recommendation_text = response.content
-            
-            # Print the raw recommendation for debugging
-            print(f"[DEBUG] Raw AI recommendation text: {recommendation_text[:200]}...")
-            
-            # Analyze the recommendation to determine if car rental is recommended
-            should_rent_car = self.extract_rental_recommendation(recommendation_text)
+            # The prompt captures every input that shapes the answer, so it is the cache key
+            cache_key = hashlib.blake2b((messages[0].content + "\0" + prompt).encode(), digest_size=16).hexdigest()
+            cached = _recommendation_cache.get(cache_key)
+            if cached is not None:
+                cleaned_text, should_rent_car = cached
+                log.debug("Using cached AI recommendation - should_rent_car: %s", should_rent_car)
+            else:
+                # Stream the completion and read only up to the car rental marker, which decides should_rent_car;
+                # the rest of the tokens go to the caller as they arrive instead of after the full response
+                chunks = iter(self.model.stream(messages))
+                head = ""
+                for chunk in chunks:
+                    head += chunk.content
+                    if _CAR_RENTAL_MARKER_RE.search(head) or len(head) >= _MARKER_SEARCH_LIMIT:
+                        break
+                
+                if _CAR_RENTAL_MARKER_RE.search(head):
+                    should_rent_car = self.extract_rental_recommendation(head)
+                    log.debug("AI recommendation analyzed - should_rent_car: %s", should_rent_car)
+                    user_prefs['should_rent_car'] = should_rent_car
+                    return self._stream_recommendation(head, chunks, cache_key, should_rent_car)
+                
+                # No marker up front: analyze the whole response, as the text-based fallbacks need it
+                recommendation_text = head + "".join(chunk.content for chunk in chunks)
+                
+                # Print the raw recommendation for debugging
+                log.debug("Raw AI recommendation text: %.200s...", recommendation_text)
+                
+                # Analyze the recommendation to determine if car rental is recommended
+                should_rent_car = self.extract_rental_recommendation(recommendation_text)
+                
+                log.debug("AI recommendation analyzed - should_rent_car: %s", should_rent_car)
+                
+                # Remove the [car_rental:YES/NO] markers from the text before displaying to the user
+                cleaned_text = _CAR_RENTAL_MARKER_RE.sub('', recommendation_text)
+                _recommendation_cache[cache_key] = (cleaned_text, should_rent_car)
             
             # Update the user_prefs with the new should_rent_car value
             user_prefs['should_rent_car'] = should_rent_car
             
-            print(f"[DEBUG] AI recommendation analyzed - should_rent_car: {should_rent_car}")
-            
-            # Remove the [car_rental:YES/NO] markers from the text before displaying to the user
-            cleaned_text = re.sub(r'\[car_rental:(yes|no)\]', '', recommendation_text, flags=re.IGNORECASE)
-            
-            # Generate message chunks with the cleaned content for streaming
-            def generate_chunks():
-                yield AIMessage(content=cleaned_text)
-                
-            return generate_chunks()
-        except Exception as e:
-            print(f"Error in get_ai_recommendation: {e}")
-            return None
\ No newline at end of file
+            # The whole cleaned text as a one-message stream
+            return iter((AIMessage(content=cleaned_text),))
+        except Exception:
+            log.exception("Error in get_ai_recommendation")
+            return None
+    
+    @staticmethod
+    def _stream_recommendation(head, chunks, cache_key, should_rent_car):
+        """Yield the already-read head, then the remaining chunks as they arrive, with every car rental
+        marker removed; the stripped full text is cached once the stream has been consumed"""
+        parts = []
+        pending = head
+        for chunk in chunks:
+            if not chunk.content:
+                continue
+            # Strip markers from the combined text, but hold back a tail that could be the start of
+            # a marker split across chunks
+            pending = _CAR_RENTAL_MARKER_RE.sub('', pending + chunk.content)
+            if len(pending) > _MARKER_CARRY:
+                text, pending = pending[:-_MARKER_CARRY], pending[-_MARKER_CARRY:]
+                parts.append(text)
+                yield AIMessage(content=text)
+        pending = _CAR_RENTAL_MARKER_RE.sub('', pending)
+        if pending:
+            parts.append(pending)
+            yield AIMessage(content=pending)
+        _recommendation_cache[cache_key] = ("".join(parts), should_rent_car)
\ No newline at end of file
@@ -138,8 +138,7 @@ document.addEventListener('DOMContentLoaded', function() {
         budget: null,
         ai_recommendation_generated: false,
         user_input_processed: false,
-        session_id: null,
-        rental_post: null
+        session_id: null
     };
 
     // Handle form submission
@@ -183,7 +182,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Process user input by sending to backend
-    function processUserInput(message) {
+    function processUserInput(message, intent) {
         // Show loading spinner
         loadingSpinner.classList.remove('d-none');
         
@@ -202,6 +201,11 @@ document.addEventListener('DOMContentLoaded', function() {
             session_id: state.session_id || ''
         });
         
+        // Tell the server what a button press means instead of making it parse the message text
+        if (intent) {
+            params.append('intent', intent);
+        }
+        
         // Add selected attractions if in recommend step
         if (state.step === 'recommend' && state.selectedAttractions.length > 0) {
             params.append('selected_attraction_ids', JSON.stringify(state.selectedAttractions.map(a => a.id)));
@@ -251,7 +255,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 // 自动触发: 只有当上一步是 recommend，且新 step 是 strategy 时
                 if (prevStep === 'recommend' && state.step === 'strategy') {
                     setTimeout(() => {
-                        processUserInput('Here are my selected attractions');
+                        processUserInput('Here are my selected attractions', 'confirm_selection');
                     }, 0);
                 }
                 // Store session_id if provided
@@ -288,7 +292,6 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (data.itinerary) updateItinerary(data.itinerary);
                 if (data.budget) updateBudget(data.budget);
                 if (data.response) updateConfirmation(data.response);
-                // if (data.rental_post) updateRentalPost(data.rental_post); // Remove UI update call
                 // 关键修改：如果进入 complete 阶段（即 route 阶段返回 next_step: 'complete'），直接渲染 itinerary 和 budget，不再发起新的请求
                 if (state.step === 'complete') {
                     // 已经在本次响应中渲染 itinerary 和 budget，无需再发 step=complete 请求
@@ -311,7 +314,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         userInput.focus();
                     }
                 }
-                if (prevStep === 'communication' && state.step === 'route') {
+                if (prevStep === 'strategy' && state.step === 'route') {
                     const userInput = document.getElementById('user-input');
                     if (userInput) {
                         userInput.value = 'I am ready to go to next step';
@@ -579,7 +582,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (selectedAttractions.length > 0) {
             state.selectedAttractions = selectedAttractions; // Ensure state is up-to-date
             updateSelectedAttractionsList(selectedAttractions); // Update UI list
-            processUserInput('Here are my selected attractions');
+            processUserInput('Here are my selected attractions', 'confirm_selection');
         } else {
             addChatMessage('Please select at least one attraction from the recommendations.', 'assistant');
         }
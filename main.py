@@ -1,16 +1,46 @@
 from flask import Flask, render_template, request, jsonify, session, send_from_directory, send_file, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_session import Session
+import logging
 import os
 import json
 from dotenv import load_dotenv
 from workflows.travel_graph import TravelGraph
+from utils import load_json_file, json_loads, TTLCache
 import requests
-import time
+
+try:
+    import orjson # Optional: much faster encoding of the attraction/map payloads
+except ImportError:
+    orjson = None
 
 # Load environment variables
 load_dotenv()
 
+# Without this only WARNING and above reach stderr (via logging's last-resort handler)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger(__name__)
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson when it is installed"""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None:
+            try:
+                # default= keeps Flask's handling of dates, UUIDs, dataclasses, ...
+                return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+            except TypeError:
+                pass # e.g. ints beyond 64 bits; let the stdlib encoder have a go
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return json_loads(s)
+
+
 app = Flask(__name__, static_folder="frontend/static", template_folder="frontend/templates")
+app.json = ORJSONProvider(app)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "travel-ai-secret")
 
 # Configure session
@@ -28,8 +58,17 @@ Session(app)
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Disable caching
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-# Create a session store for workflows
-workflows = {}
+# Create a session store for workflows: one TravelGraph per browser session, bounded, and dropped
+# after the same idle time as the Flask session so abandoned sessions don't accumulate
+workflows = TTLCache(maxsize=int(os.environ.get("TRAVEL_MAX_SESSIONS", 1000)),
+                     ttl=app.config['PERMANENT_SESSION_LIFETIME'])
+
+def _get_workflow(session_id):
+    """The session's workflow, or None; each access restarts its idle timer"""
+    workflow = workflows.get(session_id)
+    if workflow is not None:
+        workflows[session_id] = workflow
+    return workflow
 
 @app.route('/test-image')
 def test_image():
@@ -47,15 +86,14 @@ def index():
     if not session_id:
         session_id = os.urandom(16).hex()
         session['session_id'] = session_id
-        workflows[session_id] = TravelGraph()
-        print(f"[DEBUG] Created new session: {session_id}")
+        workflows[session_id] = TravelGraph(session_ttl=app.config['PERMANENT_SESSION_LIFETIME'])
+        log.debug("Created new session: %s", session_id)
     else:
-        print(f"[DEBUG] Using existing session: {session_id}")
+        log.debug("Using existing session: %s", session_id)
     
     # Load popular attractions
     try:
-        with open('frontend/data/popular_attractions.json', 'r') as f:
-            popular_attractions = json.load(f)
+        popular_attractions = load_json_file('frontend/data/popular_attractions.json')
     except FileNotFoundError:
         popular_attractions = []
     
@@ -71,24 +109,25 @@ def process():
         if not session_id:
             session_id = os.urandom(16).hex()
             session['session_id'] = session_id
-            workflows[session_id] = TravelGraph()
-            print(f"[DEBUG] Created new session: {session_id}")
+            workflows[session_id] = TravelGraph(session_ttl=app.config['PERMANENT_SESSION_LIFETIME'])
+            log.debug("Created new session: %s", session_id)
         else:
-            print(f"[DEBUG] Using existing session: {session_id}")
-        if session_id not in workflows:
-            workflows[session_id] = TravelGraph()
-            print(f"[DEBUG] Recreated workflow for session: {session_id}")
-        workflow = workflows[session_id]
+            log.debug("Using existing session: %s", session_id)
+        workflow = _get_workflow(session_id)
+        if workflow is None:
+            workflow = workflows[session_id] = TravelGraph(session_ttl=app.config['PERMANENT_SESSION_LIFETIME'])
+            log.debug("Recreated workflow for session: %s", session_id)
         # Keep only critical step information for logging
-        print(f"[DEBUG] Processing step: {data.get('step', 'chat')} for session: {session_id}")
+        log.debug("Processing step: %s for session: %s", data.get('step', 'chat'), session_id)
         # Process the current step
         step_name = data.get('step', 'chat')
-        result = workflow.process_step(step_name, **data)
+        # The Flask session id keys the graph's state; it overrides any session_id in the body
+        result = workflow.process_step(step_name, **{**data, "session_id": session_id})
         # Add the current state to the result
-        result['state'] = workflow.get_current_state()
+        result['state'] = workflow.get_current_state(session_id)
         return jsonify(result)
     except Exception as e:
-        print(f"[ERROR] in process route: {str(e)}")
+        log.exception("Error in process route")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/attractions/<city>')
@@ -96,10 +135,10 @@ def get_attractions(city):
     """Get attractions for a specific city"""
     session_id = session.get('session_id')
     
-    if not session_id or session_id not in workflows:
+    workflow = _get_workflow(session_id) if session_id else None
+    if workflow is None:
         return jsonify({"error": "Session not found"}), 404
     
-    workflow = workflows[session_id]
     info_agent = workflow.info_agent
     
     attractions = info_agent.get_attractions(city)
@@ -110,8 +149,8 @@ def reset_session():
     """Reset the current session"""
     session_id = session.get('session_id')
     
-    if session_id and session_id in workflows:
-        del workflows[session_id]
+    if session_id:
+        workflows.pop(session_id, None)
     
     session.clear()
     return jsonify({"status": "session reset"})
@@ -123,19 +162,21 @@ def stream():
     if not session_id:
         session_id = os.urandom(16).hex()
         session['session_id'] = session_id
-        workflows[session_id] = TravelGraph()
-        print(f"[DEBUG] Created new session: {session_id}")
+        workflows[session_id] = TravelGraph(session_ttl=app.config['PERMANENT_SESSION_LIFETIME'])
+        log.debug("Created new session: %s", session_id)
     else:
-        print(f"[DEBUG] Using existing session: {session_id}")
-    if session_id not in workflows:
-        workflows[session_id] = TravelGraph()
-        print(f"[DEBUG] Recreated workflow for session: {session_id}")
-    workflow = workflows[session_id]
+        log.debug("Using existing session: %s", session_id)
+    workflow = _get_workflow(session_id)
+    if workflow is None:
+        workflow = workflows[session_id] = TravelGraph(session_ttl=app.config['PERMANENT_SESSION_LIFETIME'])
+        log.debug("Recreated workflow for session: %s", session_id)
     # Keep only critical step information for logging
-    print(f"[DEBUG] Streaming step for session: {session_id}")
+    log.debug("Streaming step for session: %s", session_id)
     # Get parameters from request
     step_name = request.args.get('step', 'chat')
     user_input = request.args.get('user_input', '')
+    intent = request.args.get('intent') # e.g. "confirm_selection" from the confirm button
+    include_map_data = request.args.get('include_map_data', True) # clients that already hold the markers send "false"
     selected_attraction_ids = request.args.get('selected_attraction_ids')
     if selected_attraction_ids:
         try:
@@ -144,30 +185,32 @@ def stream():
             selected_attraction_ids = None
             
     # Check if the user is confirming satisfaction with the recommendation
-    satisfaction_message = 'satisfied with your recommendation' in user_input.lower()
+    satisfaction_message = intent == 'satisfaction' or (not intent and 'satisfied with your recommendation' in user_input.lower())
     
     if satisfaction_message:
-        print(f"[CRITICAL] Detected satisfaction message: '{user_input}'")
+        log.info("Detected satisfaction message: '%s'", user_input)
     
     def generate():
         try:
             # Process the step
             result = workflow.process_step(
-                step_name, 
+                step_name,
+                session_id=session_id,
                 user_input=user_input,
-                selected_attraction_ids=selected_attraction_ids
+                selected_attraction_ids=selected_attraction_ids,
+                intent=intent,
+                include_map_data=include_map_data
             )
             
             # Check the should_rent_car status right after processing
-            current_should_rent_car = workflow.get_current_state().get('should_rent_car', False)
-            print(f"[CRITICAL] After processing step, should_rent_car = {current_should_rent_car}")
+            current_should_rent_car = workflow.get_current_state(session_id).get('should_rent_car', False)
+            log.info("After processing step, should_rent_car = %s", current_should_rent_car)
             
             # Handle streaming response
             if 'stream' in result and result['stream']:
                 for chunk in result['stream']:
                     if chunk.content:
                         yield f"data: {{\"type\": \"chunk\", \"content\": {json.dumps(chunk.content)} }}\n\n"
-                        time.sleep(0.01)
             
             # Send completion data
             completion_data = {
@@ -180,39 +223,32 @@ def stream():
                 'itinerary': result.get('itinerary'),
                 'budget': result.get('budget'),
                 'response': result.get('response'),
-                'optimal_route': result.get('optimal_route'),
-                'rental_post': result.get('rental_post')
+                'optimal_route': result.get('optimal_route')
             }
             
             # Only override next_step in specific cases
             if step_name == 'strategy':
-                current_state = workflow.get_current_state()
+                current_state = workflow.get_current_state(session_id)
                 ai_recommendation_generated = current_state.get('ai_recommendation_generated', False)
                 should_rent_car = current_state.get('should_rent_car', False)
                 
-                print(f"[CRITICAL] In stream endpoint, strategy step: ai_recommendation_generated={ai_recommendation_generated}, should_rent_car={should_rent_car}, satisfaction_message={satisfaction_message}")
+                log.info("In stream endpoint, strategy step: ai_recommendation_generated=%s, should_rent_car=%s, satisfaction_message=%s", ai_recommendation_generated, should_rent_car, satisfaction_message)
                 
                 # If the AI has provided recommendations (whether through initial selection or satisfaction confirmation)
                 if ai_recommendation_generated or satisfaction_message:
-                    # IMPORTANT: Double-check the should_rent_car value from the current state
-                    next_step = 'communication' if should_rent_car else 'route'
+                    # Always continue to route planning; a recommended rental car is costed into the route budget
+                    next_step = 'route'
                     completion_data['next_step'] = next_step
-                    print(f"[CRITICAL] Setting next_step to '{next_step}' based on should_rent_car={should_rent_car}")
-                    
-                    # Add explicit note about car recommendation decision
-                    if should_rent_car:
-                        print("[CRITICAL] Car rental IS recommended - moving to communication step")
-                    else:
-                        print("[CRITICAL] Car rental is NOT recommended - skipping directly to route step")
+                    log.info("Setting next_step to '%s' (should_rent_car=%s)", next_step, should_rent_car)
                 
-            yield f"data: {json.dumps(completion_data)}\n\n"
+            yield f"data: {app.json.dumps(completion_data)}\n\n"
             
             # Verify the final decision after sending the completion data
             final_next_step = completion_data.get('next_step')
-            print(f"[CRITICAL] Final decision: next_step = {final_next_step}, should_rent_car = {workflow.get_current_state().get('should_rent_car', False)}")
+            log.info("Final decision: next_step = %s, should_rent_car = %s", final_next_step, workflow.get_current_state(session_id).get('should_rent_car', False))
             
         except Exception as e:
-            print(f"[ERROR] in stream route: {str(e)}")
+            log.exception("Error in stream route")
             yield f"data: {{\"type\": \"error\", \"error\": {json.dumps(str(e))} }}\n\n"
     return Response(generate(), mimetype='text/event-stream')
 
@@ -221,10 +257,10 @@ def get_nearby_places(attraction_id):
     """Get nearby restaurants and street information for an attraction"""
     session_id = session.get('session_id')
     
-    if not session_id or session_id not in workflows:
+    workflow = _get_workflow(session_id) if session_id else None
+    if workflow is None:
         return jsonify({"error": "Session not found"}), 404
     
-    workflow = workflows[session_id]
     info_agent = workflow.info_agent
     
     # Parse coordinates from attraction_id
@@ -1,16 +1,36 @@
+import heapq
 import http.client
-import json
+import logging
 import os
+import threading
 from datetime import datetime, timedelta
 from urllib.parse import quote # For URL encoding location names
 from urllib.parse import urlencode # For building query strings
 
+from utils import json_loads, JSON_ERRORS
+
+try:
+    import ijson # Optional: stream-parse large responses instead of loading the whole body
+except ImportError:
+    ijson = None
+
+log = logging.getLogger(__name__)
+
 class CarRentalService:
     """
     Service class for interacting with 'booking-com-api5.p.rapidapi.com' API via RapidAPI.
     Gets car rental data, processes to extract key information, sorts by price by default,
     returns top 10 results.
     """
+    # Fixed query shape for /car/avaliable-car, in find_available_cars argument order
+    _QS_KEYS = (
+        "pickup_latitude", "pickup_longtitude", # API's spelling
+        "pickup_date", "pickup_time",
+        "dropoff_latitude", "dropoff_longtitude", # API's spelling
+        "drop_date", "drop_time",               # API's names
+        "currency_code",
+    )
+
     def __init__(self, rapidapi_key: str):
         """
         Initialize the service with a RapidAPI key.
@@ -28,20 +48,19 @@ class CarRentalService:
             "X-RapidAPI-Key": self.api_key,
             "X-RapidAPI-Host": self.api_host
         }
-        print(f"CarRentalService initialized, host: {self.api_host}")
-
-    def _process_response(self, api_response: dict) -> list[dict]:
+        self.timeout = 15 # seconds, per socket operation
+        # One keep-alive HTTPS connection reused across searches; http.client is not
+        # thread-safe, so requests on it are serialized by the lock
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        log.debug("CarRentalService initialized, host: %s", self.api_host)
+
+    def _iter_car_offers(self, offers):
         """
-        (Internal helper method) Process the raw API response, extract simplified information.
+        (Internal helper method) Yield simplified car data for each valid offer.
+        Accepts any iterable so offers can be fed straight from a streaming parser.
         """
-        if not api_response or not isinstance(api_response, dict): return [] # Basic check
-        search_results = api_response.get("data", {}).get("search_results", [])
-        if not isinstance(search_results, list): return [] # Check if it's a list
-        if not search_results: return [] # Check if the list is empty
-
-        processed_cars = []
-
-        for offer in search_results:
+        for offer in offers:
             if not isinstance(offer, dict): continue # Skip invalid items
             try:
                 pricing_info = offer.get("pricing_info", {})
@@ -53,7 +72,7 @@ class CarRentalService:
                 price = pricing_info.get("drive_away_price")
                 if price is None: continue # Skip items without price
 
-                car_data = {
+                yield {
                     "car_model": vehicle_info.get("v_name", "N/A"),
                     "car_group": vehicle_info.get("group", "N/A"),
                     "price": price,
@@ -62,29 +81,41 @@ class CarRentalService:
                     "pickup_location_name": pickup_info.get("name", "N/A"),
                     "supplier_name": supplier_info.get("name", "N/A"),
                 }
-                processed_cars.append(car_data)
             except Exception as e:
-                print(f"Warning: Error processing individual offer: {e}")
+                log.warning("Error processing individual offer: %s", e)
                 continue
 
-        print(f"Processed {len(processed_cars)} valid car rental options.")
-        return processed_cars
-
-    def _sort_and_limit(self, processed_cars: list[dict], sort_by='price', limit=30) -> list[dict]:
-        """(Internal helper method) Sort and limit the list."""
-        if not processed_cars: return []
-        # ... (sorting and limiting logic remains unchanged) ...
-        key_func = None; reverse_sort = False
-        if sort_by == 'price':
-            key_func = lambda x: x.get('price', float('inf')); reverse_sort = False
-            print("Sorting by price (low to high)...")
-        else: print(f"Warning: Unknown sorting option '{sort_by}'.")
-        if key_func:
-            try: processed_cars.sort(key=key_func, reverse=reverse_sort)
-            except Exception as e: print(f"Sorting error: {e}.")
-        final_count = min(len(processed_cars), limit)
-        print(f"Limiting results to top {final_count}.")
-        return processed_cars[:final_count]
+    def _reset_connection(self):
+        """(Internal helper method) Drop the keep-alive connection; the next request reconnects."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _send_request(self, path: str) -> http.client.HTTPResponse:
+        """(Internal helper method) GET path on the keep-alive connection, reconnecting once if the server closed it."""
+        for attempt in range(2):
+            if self._conn is None:
+                self._conn = http.client.HTTPSConnection(self.api_host, timeout=self.timeout)
+            try:
+                self._conn.request("GET", path, headers=self.headers)
+                return self._conn.getresponse()
+            except (ConnectionResetError, BrokenPipeError): # includes http.client.RemoteDisconnected
+                self._reset_connection()
+                if attempt: raise
+
+    def _top_cars_by_price(self, offers, limit: int = 10) -> list[dict]:
+        """
+        (Internal helper method) Single pass over the offers keeping the `limit` cheapest.
+        Uses a bounded max-heap, so memory stays O(limit) however many offers arrive.
+        Ties keep the earlier offer, matching a stable sort by price.
+        """
+        heap = [] # (-price, -arrival order, car_data); heap[0] is the current worst kept offer
+        for counter, car_data in enumerate(self._iter_car_offers(offers)):
+            entry = (-car_data["price"], -counter, car_data)
+            if len(heap) < limit: heapq.heappush(heap, entry)
+            elif entry > heap[0]: heapq.heapreplace(heap, entry)
+        log.debug("Kept top %d car rental options by price.", len(heap))
+        return [t[2] for t in sorted(heap, reverse=True)]
 
     def find_available_cars(
         self,
@@ -105,14 +136,11 @@ class CarRentalService:
             Returns None if the API call critically fails.
         """
         # --- Build API request parameters ---
-        querystring = {
-            "pickup_latitude": pickup_lat, "pickup_longtitude": pickup_lon, # API's spelling
-            "pickup_date": pickup_date, "pickup_time": pickup_time,      # HH:MM:SS
-            "dropoff_latitude": dropoff_lat, "dropoff_longtitude": dropoff_lon, # API's spelling
-            "drop_date": dropoff_date,        # API's name
-            "drop_time": dropoff_time,        # API's name, HH:MM:SS
-            "currency_code": currency_code
-        }
+        querystring = dict(zip(self._QS_KEYS, (
+            pickup_lat, pickup_lon, pickup_date, pickup_time,       # HH:MM:SS
+            dropoff_lat, dropoff_lon, dropoff_date, dropoff_time,   # HH:MM:SS
+            currency_code,
+        )))
         if driver_age is not None: querystring["driver_age"] = driver_age
         if language_code is not None: querystring["languagecode"] = language_code
         if pickup_loc_name is not None: querystring["pickup_location"] = pickup_loc_name
@@ -120,33 +148,43 @@ class CarRentalService:
 
         # Build the endpoint with query parameters
         endpoint_with_params = f"{self.endpoint}?{urlencode(querystring)}"
-        print(f"Preparing request: {endpoint_with_params}")
 
+        with self._conn_lock:
+            return self._search(endpoint_with_params)
+
+    def _search(self, endpoint_with_params: str) -> list[dict] | None:
+        """(Internal helper method) Run one search on the shared connection; caller holds _conn_lock."""
+        reusable = False
         try:
             # --- Send API request using http.client ---
-            conn = http.client.HTTPSConnection(self.api_host)
-            conn.request("GET", endpoint_with_params, headers=self.headers)
-            response = conn.getresponse()
-            print(f"API request status: {response.status}")
+            response = self._send_request(endpoint_with_params)
+            log.debug("API request status: %s", response.status)
             
             if response.status != 200:
-                print(f"Error: API returned status code {response.status}")
+                log.error("API returned status code %s", response.status)
+                response.read() # drain so the connection can be reused
+                reusable = not response.will_close
                 return None
-                
-            data = response.read()
-            conn.close()
-            
-            # Parse JSON response
-            raw_data = json.loads(data.decode('utf-8'))
-            print("API response successfully parsed")
 
-            # --- Process, sort, limit ---
-            processed_data = self._process_response(raw_data)
-            final_results = self._sort_and_limit(processed_data, sort_by='price', limit=10)
+            if ijson is not None:
+                # Stream offers straight off the socket; only search_results items become dicts
+                offers = ijson.items(response, 'data.search_results.item', use_float=True)
+            else:
+                data = response.read()
+                raw_data = json_loads(data) # parse the UTF-8 bytes directly
+                offers = raw_data.get("data", {}).get("search_results", []) if isinstance(raw_data, dict) else []
+                if not isinstance(offers, list): offers = []
+
+            # --- Process, sort, limit: top 10 by price without materializing every offer ---
+            final_results = self._top_cars_by_price(offers, limit=10)
+            response.read() # drain whatever the streaming parser left unread
+            reusable = not response.will_close
 
             return final_results # Return the final results list
 
         # --- Error handling ---
-        except http.client.HTTPException as e: print(f"Error: HTTP connection issue - {e}"); return None
-        except json.JSONDecodeError as e: print(f"Error: Failed to parse JSON response - {e}"); print(f"Received raw response text (first 500 chars): {data.decode('utf-8')[:500] if 'data' in locals() else 'No data'}"); return None
-        except Exception as e: print(f"Unexpected error occurred: {e}"); return None
+        except http.client.HTTPException as e: log.error("HTTP connection issue - %s", e); return None
+        except JSON_ERRORS as e: log.error("Failed to parse JSON response - %s", e); log.debug("Received raw response text (first 500 chars): %s", data.decode('utf-8')[:500] if 'data' in locals() else 'No data'); return None
+        except Exception as e: log.error("Unexpected error occurred: %s", e); return None
+        finally:
+            if not reusable: self._reset_connection()
@@ -1,8 +1,67 @@
-import json
+import atexit
+import logging
 import os
+import threading
 from typing import Optional, Dict, Any
-from utils import ask_openai, extract_price
+from utils import ask_openai, extract_price, load_json_file, load_json_lines, dump_json_lines
 import time
+
+log = logging.getLogger(__name__)
+
+# Append-only log: one {"k": city, "v": country} object per line
+_CITY_COUNTRY_PATH = os.path.join('data', 'city_country_cache.jsonl')
+_CITY_COUNTRY_FLUSH_INTERVAL = 60  # seconds between appends to the cache file
+
+
+# city -> country resolutions survive restarts; the answer never changes for a city
+_CITY_COUNTRY: Dict[str, str] = load_json_lines(_CITY_COUNTRY_PATH)
+_city_country_dirty_keys = set()
+_city_country_flushed_at = time.monotonic()
+# Guards the dict, the dirty set and the flush timestamp; route steps resolve cities from several threads
+_city_country_lock = threading.Lock()
+
+
+def _flush_city_country() -> None:
+    """Append resolutions not yet on disk; cost scales with new entries, not cache size."""
+    global _city_country_flushed_at
+    with _city_country_lock:
+        # Snapshot and clear first, so each key is appended exactly once
+        entries = [{"k": k, "v": _CITY_COUNTRY[k]} for k in _city_country_dirty_keys]
+        _city_country_dirty_keys.clear()
+        if entries:
+            try:
+                dump_json_lines(_CITY_COUNTRY_PATH, entries, append=True)
+            except OSError as e:
+                _city_country_dirty_keys.update(entry["k"] for entry in entries) # retry on the next flush
+                log.warning("can't persist city/country cache: %s", e)
+        _city_country_flushed_at = time.monotonic()
+
+
+atexit.register(_flush_city_country)
+
+
+def _city_to_country(city: str) -> str:
+    """Resolve the country of a city, asking OpenAI only on a cache miss."""
+    key = city.strip().casefold()
+    country = _CITY_COUNTRY.get(key)
+    if country is not None:
+        return country
+
+    prompt = f"please determine the country of {city}/n"
+    prompt += "just return the country name, no other words"
+    country_response = ask_openai(prompt)
+    country = country_response["answer"].strip()
+
+    # Mark dirty instead of rewriting the whole file per insert; flush is debounced + at exit
+    with _city_country_lock:
+        _CITY_COUNTRY[key] = country
+        _city_country_dirty_keys.add(key)
+        flush_due = time.monotonic() - _city_country_flushed_at >= _CITY_COUNTRY_FLUSH_INTERVAL
+    if flush_due:
+        _flush_city_country()
+    return country
+
+
 ## 提供每个国家最近的油价（API太贵）
 def get_gas_price(city: str) -> Optional[float]:
     """
@@ -16,21 +75,16 @@ def get_gas_price(city: str) -> Optional[float]:
     """
     try:
         data_path = os.path.join('data', 'global_fuel_prices.json')
-        with open(data_path, 'r', encoding='utf-8') as f:
-            price_data = json.load(f)
+        price_data = load_json_file(data_path)
         
-        prompt = f"please determine the country of {city}/n"
-        prompt += "just return the country name, no other words"
-        country_response = ask_openai(prompt)
-    
-        country = country_response["answer"].strip()
-        print(f"sucessfully get the country of {city}: {country}")
+        country = _city_to_country(city)
+        log.debug("sucessfully get the country of %s: %s", city, country)
         
         if country in price_data:
             return price_data[country]
         
         else:
-            print(f" haven't found the price of {city} in the data, try to get it from openai")
+            log.debug("haven't found the price of %s in the data, try to get it from openai", city)
             max_attempts = 3  
             for attempt in range(max_attempts):
                 price_response = ask_openai(
@@ -49,14 +103,14 @@ def get_gas_price(city: str) -> Optional[float]:
                     time.sleep(1)
                     continue
             
-            print(f"❌ can't get the price of {city} after {max_attempts} attempts")
+            log.warning("can't get the price of %s after %d attempts", city, max_attempts)
             return None
         
     except FileNotFoundError:
-        print(f"❌ can't find the price data file")
+        log.error("can't find the price data file")
         return None
     except Exception as e:
-        print(f"❌ error when processing the data: {str(e)}")
+        log.error("error when processing the data: %s", e)
         return None
 
 
@@ -0,0 +1,23 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def pooled_session(pool_connections=10, pool_maxsize=50, max_retries=0):
+    """Create a requests.Session whose keep-alive pool is sized for concurrent callers"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=max_retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def retrying_session(pool_connections=2, pool_maxsize=8, total=3, backoff_factor=0.3):
+    """Pooled session that retries idempotent requests on connection errors, 429 and 5xx"""
+    retry = Retry(
+        total=total,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False, # hand the final response to raise_for_status()
+    )
+    return pooled_session(pool_connections, pool_maxsize, max_retries=retry)
@@ -1,13 +1,155 @@
+import copy
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+
 import googlemaps
 
+from services.http_session import pooled_session
+from utils import TTLCache
+
+log = logging.getLogger(__name__)
+
+# Distance Matrix API per-request limits
+MAX_MATRIX_ORIGINS = 25
+MAX_MATRIX_DESTINATIONS = 25
+MAX_MATRIX_ELEMENTS = 100
+
+
+@lru_cache(maxsize=4)
+def get_gmaps_client(api_key):
+    """Shared googlemaps.Client per API key, so every caller reuses one connection pool"""
+    return googlemaps.Client(key=api_key, timeout=10, requests_session=pooled_session())
+
+
+# Responses shared by every POIApi instance in the process, keyed by (api key, method, args).
+# Entries are (fresh_until, response) and live for 2x their TTL: in the second half they are
+# served stale while a background refresh runs (stale-while-revalidate).
+_response_cache = TTLCache(maxsize=2048, ttl=3600)
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="poi-refresh")
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+# Single-flight: concurrent misses on one key wait for the first caller's request
+_inflight = {}
+_inflight_lock = threading.Lock()
+_MISS = object()
+NEGATIVE_CACHE_TTL = 300  # seconds a Google API error is replayed before the request is retried
+
+
+class _CachedFailure:
+    """Marks a cached googlemaps.exceptions.ApiError that should be re-raised on hit"""
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _freeze(value):
+    """Turn call arguments into something hashable (lists -> tuples, dicts -> sorted items)"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(_freeze(v) for v in value)
+    return value
+
+
+def _cached(ttl):
+    """Memoize a POIApi method's response: fresh for ttl seconds, then stale-while-revalidate for another ttl"""
+    def decorator(method):
+        name = method.__name__
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            # The cached response is shared by every caller and session; each caller gets its own copy
+            return copy.deepcopy(lookup(self, args, kwargs))
+
+        def lookup(self, args, kwargs):
+            # Fast path: scalar-only calls are already hashable, so skip the recursive freeze
+            key = (self.api_key, name, args, tuple(kwargs.items()))
+            try:
+                hash(key)
+            except TypeError:
+                key = (self.api_key, name, _freeze(args), _freeze(kwargs))
+            entry = _response_cache.get(key, _MISS)
+            if entry is _MISS:
+                return fetch_single_flight(self, key, args, kwargs)
+            fresh_until, result = entry
+            if isinstance(result, _CachedFailure):
+                raise result.error
+            if time.monotonic() >= fresh_until:
+                with _refreshing_lock:
+                    start_refresh = key not in _refreshing
+                    _refreshing.add(key)
+                if start_refresh:
+                    _refresh_executor.submit(refresh, self, key, args, kwargs)
+            return result
+
+        def fetch_single_flight(self, key, args, kwargs):
+            with _inflight_lock:
+                event = _inflight.get(key)
+                leader = event is None
+                if leader:
+                    event = _inflight[key] = threading.Event()
+            if not leader:
+                event.wait()
+                entry = _response_cache.get(key, _MISS)
+                if entry is _MISS:
+                    # The leader hit an uncached (transport) error; try on our own
+                    return fetch(self, key, args, kwargs)
+                result = entry[1]
+                if isinstance(result, _CachedFailure):
+                    raise result.error
+                return result
+            try:
+                return fetch(self, key, args, kwargs)
+            finally:
+                with _inflight_lock:
+                    _inflight.pop(key, None)
+                event.set()
+
+        def fetch(self, key, args, kwargs, cache_failure=True):
+            try:
+                result = method(self, *args, **kwargs)
+            except googlemaps.exceptions.ApiError as e:
+                if not cache_failure:
+                    raise
+                # Remember API-level failures (quota, NOT_FOUND, ...) briefly so identical
+                # calls don't hammer the API; transport errors are not cached
+                _response_cache.set(key, (time.monotonic() + NEGATIVE_CACHE_TTL, _CachedFailure(e)),
+                                    NEGATIVE_CACHE_TTL)
+                raise
+            _response_cache.set(key, (time.monotonic() + ttl, result), 2 * ttl)
+            return result
+
+        def refresh(self, key, args, kwargs):
+            try:
+                fetch(self, key, args, kwargs, cache_failure=False)
+            except Exception as e:
+                log.warning("background refresh of %s failed, keeping stale response: %s", name, e)
+            finally:
+                with _refreshing_lock:
+                    _refreshing.discard(key)
+
+        return wrapper
+    return decorator
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
 
 class POIApi:
     def __init__(self, api_key=None):
         """Initialize Points of Interest API with Google Maps client"""
         self.api_key = api_key or os.environ.get("MAPS_API_KEY")
-        self.gmaps = googlemaps.Client(key=self.api_key)
+        self.gmaps = get_gmaps_client(self.api_key)
     
+    @_cached(ttl=3600)
     def get_poi(self, location, radius=1000, keyword=None, type=None, language="en", min_price=None, max_price=None):
         """
         Search for points of interest near a location
@@ -41,6 +183,7 @@ class POIApi:
             
         return self.gmaps.places(**params)
     
+    @_cached(ttl=24 * 3600)
     def get_poi_details(self, place_id, language="en", fields=None):
         """
         Get detailed information about a specific place
@@ -63,6 +206,7 @@ class POIApi:
             
         return self.gmaps.place(**params)
     
+    @_cached(ttl=3600)
     def get_poi_reviews(self, place_id, language="en", max_reviews=5):
         """
         Get reviews for a specific place
@@ -88,6 +232,7 @@ class POIApi:
             
         return result
     
+    @_cached(ttl=3600)
     def get_nearby_places(self, location, type, radius=1000, language="en"):
         """
         Find places of a specific type near a location
@@ -108,6 +253,7 @@ class POIApi:
             language=language
         )
     
+    @_cached(ttl=3600)
     def get_distance_matrix(self, origins, destinations, mode="driving", language="en", units="metric"):
         """
         Calculate distance and duration between multiple origins and destinations
@@ -130,6 +276,67 @@ class POIApi:
             units=units
         )
     
+    def geocode_many(self, addresses, max_workers=8):
+        """
+        Geocode several addresses concurrently
+        
+        Args:
+            addresses: List of addresses to geocode
+            max_workers: Maximum number of requests in flight at once
+            
+        Returns:
+            List of geocode results, in the same order as addresses
+        """
+        addresses = list(addresses)
+        if not addresses:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(addresses))) as pool:
+            return list(pool.map(self.gmaps.geocode, addresses))
+    
+    def get_distance_matrix_batched(self, origins, destinations, mode="driving", language="en",
+                                    units="metric", max_workers=4):
+        """
+        Distance matrix for any number of origins/destinations, split into requests
+        that respect the API's per-request limits and fetched concurrently
+        
+        Args:
+            origins: List of addresses or lat/lng values
+            destinations: List of addresses or lat/lng values
+            mode, language, units: Same as get_distance_matrix
+            max_workers: Maximum number of requests in flight at once
+            
+        Returns:
+            Distance matrix results merged into the single-request response shape
+        """
+        origins, destinations = list(origins), list(destinations)
+        if not origins or not destinations:
+            return {"origin_addresses": [], "destination_addresses": [], "rows": [], "status": "OK"}
+        
+        dest_chunks = _chunks(destinations, MAX_MATRIX_DESTINATIONS)
+        origins_per_request = max(1, min(MAX_MATRIX_ORIGINS, MAX_MATRIX_ELEMENTS // len(dest_chunks[0])))
+        origin_chunks = _chunks(origins, origins_per_request)
+        
+        def fetch(job):
+            o, d = job
+            return self.get_distance_matrix(origin_chunks[o], dest_chunks[d], mode=mode, language=language, units=units)
+        
+        jobs = [(o, d) for o in range(len(origin_chunks)) for d in range(len(dest_chunks))]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+            results = dict(zip(jobs, pool.map(fetch, jobs)))
+        
+        merged = {"origin_addresses": [], "destination_addresses": [], "rows": [], "status": "OK"}
+        for d in range(len(dest_chunks)):
+            merged["destination_addresses"].extend(results[(0, d)].get("destination_addresses", []))
+        for o in range(len(origin_chunks)):
+            merged["origin_addresses"].extend(results[(o, 0)].get("origin_addresses", []))
+            # Stitch each origin's row back together across the destination chunks
+            for r in range(len(origin_chunks[o])):
+                elements = []
+                for d in range(len(dest_chunks)):
+                    elements.extend(results[(o, d)]["rows"][r]["elements"])
+                merged["rows"].append({"elements": elements})
+        return merged
+    
     def get_place_photos(self, photo_reference, max_width=400, max_height=400):
         """
         Get photos for a place
@@ -24,75 +24,174 @@ The returned data is in the following format:
 
 """
 
+import atexit
+from collections import defaultdict
+import numpy as np
 import requests
 from datetime import datetime, timedelta
-import json
-import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import count, islice, zip_longest
+
+from urllib3.exceptions import HTTPError as Urllib3Error
+
+from services.http_session import retrying_session
+from utils import json_loads, dump_json_lines, load_json_lines, JSON_ERRORS
+
+try:
+    import ijson # Optional: stream-parse archive responses, keeping only the "daily" arrays
+except ImportError:
+    ijson = None
+
+# Archive metrics averaged by _average_historical_data, in column order
+_HISTORICAL_METRICS = ("temperature_2m_max", "temperature_2m_min", "precipitation_sum", "wind_speed_10m_max")
+
+# How long cached results stay valid (wall clock, since the cache is persisted)
+_FORECAST_TTL = 6 * 3600         # per forecast day; forecasts are revised through the day
+_HISTORICAL_TTL = 7 * 24 * 3600  # per historical-estimate window; archive data barely changes
+_CACHE_FLUSH_INTERVAL = 60       # seconds between appends to the cache file
+
+
+@lru_cache(maxsize=1)
+def get_weather_session():
+    """Shared retrying session for Open-Meteo, so every WeatherService reuses one connection pool"""
+    return retrying_session(pool_maxsize=16)
 
 class WeatherService:
+    # The cache file is read once per process and the dict is shared by every instance.
+    # Entries are {"data": ..., "expires": epoch seconds}; on disk they are an append-only
+    # log of {"k": key, "v": entry} lines where later lines win.
+    _shared_cache = None
+    _cache_lock = threading.Lock()
+    _cache_dirty_keys = set()
+    _cache_flushed_at = time.monotonic()
+
     def __init__(self):
         """Initialize the weather service"""
         self.forecast_url = "https://api.open-meteo.com/v1/forecast"
         self.historical_url = "https://archive-api.open-meteo.com/v1/archive"
-        self.cache_file = "weather_cache.json"
-        self.cache = self._load_cache()
+        self._session = get_weather_session()
+        self.cache_file = "weather_cache.jsonl"
+        with WeatherService._cache_lock:
+            if WeatherService._shared_cache is None:
+                WeatherService._shared_cache = self._load_cache()
+                atexit.register(self.flush)
+        self.cache = WeatherService._shared_cache
 
     def _load_cache(self):
-        """Load weather cache from file"""
-        if os.path.exists(self.cache_file):
-            with open(self.cache_file, 'r') as f:
-                try:
-                    return json.load(f)
-                except json.JSONDecodeError:
-                    return {}
-        return {}
+        """Replay the cache log, dropping expired entries"""
+        now = time.time()
+        return load_json_lines(self.cache_file, keep=lambda v: isinstance(v, dict) and v.get("expires", 0) > now)
 
     def _save_cache(self):
-        """Save weather cache to file"""
-        with open(self.cache_file, 'w') as f:
-            json.dump(self.cache, f)
+        """Append entries not yet on disk; cost scales with new entries, not cache size"""
+        dump_json_lines(self.cache_file,
+                        ({"k": k, "v": self.cache[k]} for k in WeatherService._cache_dirty_keys if k in self.cache),
+                        append=True)
+
+    def flush(self):
+        """Write cache entries added since the last write"""
+        with WeatherService._cache_lock:
+            if WeatherService._cache_dirty_keys:
+                try:
+                    self._save_cache()
+                    WeatherService._cache_dirty_keys.clear()
+                except OSError as e:
+                    print(f"Could not save {self.cache_file}: {e}")
+            WeatherService._cache_flushed_at = time.monotonic()
 
     def _cache_key(self, lat, lng, date):
         """Generate a cache key for a location and date"""
         return f"{lat}_{lng}_{date}"
 
+    def _cache_get(self, key):
+        """Return cached data for key, or None if missing/expired"""
+        entry = self.cache.get(key)
+        if entry is None or entry["expires"] <= time.time():
+            return None
+        return entry["data"]
+
+    def _cache_put(self, key, data, ttl):
+        with WeatherService._cache_lock:
+            self.cache[key] = {"data": data, "expires": time.time() + ttl}
+            WeatherService._cache_dirty_keys.add(key)
+
     def get_weather(self, lat, lng, start_date, duration):
         """Get weather forecast or historical data for a location and date range"""
-        start = datetime.strptime(start_date, "%Y-%m-%d")
+        start = datetime.fromisoformat(start_date)
         end = start + timedelta(days=duration - 1)
         today = datetime.now()
+        # ~100 m grid, so nearby lookups for the same city share cache entries
+        location = (round(lat, 3), round(lng, 3))
 
         if end <= today + timedelta(days=15):
             # Use forecast data
-            return self._get_forecast_data(lat, lng, start, end)
+            result = self._get_cached_forecast(lat, lng, location, start, end)
         else:
             # Use historical data
-            return self._get_historical_estimate(lat, lng, start, end)
+            result = self._get_cached_historical(lat, lng, location, start, end)
+
+        # Mutations only mark keys dirty; they are appended at most once per interval (and at exit)
+        if WeatherService._cache_dirty_keys and time.monotonic() - WeatherService._cache_flushed_at >= _CACHE_FLUSH_INTERVAL:
+            self.flush()
+        return result
+
+    def _get_cached_forecast(self, lat, lng, location, start, end):
+        """Serve forecast days from the cache, fetching only the span of days that are missing"""
+        days = [(start + timedelta(days=i)).date().isoformat() for i in range((end - start).days + 1)]
+        by_day = {day: self._cache_get(self._cache_key(*location, day)) for day in days}
+        missing = [day for day in days if by_day[day] is None]
+        if not missing:
+            return [dict(by_day[day]) for day in days]
+
+        fetched = self._get_forecast_data(lat, lng, datetime.fromisoformat(missing[0]),
+                                          datetime.fromisoformat(missing[-1]))
+        if isinstance(fetched, dict): # error payload
+            return fetched
+        for day_data in fetched:
+            self._cache_put(self._cache_key(*location, day_data["date"]), day_data, _FORECAST_TTL)
+            by_day[day_data["date"]] = day_data
+        return [dict(by_day[day]) for day in days if by_day[day] is not None]
+
+    def _get_cached_historical(self, lat, lng, location, start, end):
+        """Serve a historical estimate for the whole window from the cache when possible"""
+        key = self._cache_key(*location, f"historical_{start:%Y-%m-%d}_{end:%Y-%m-%d}")
+        cached = self._cache_get(key)
+        if cached is not None:
+            return [dict(day) for day in cached]
+
+        result = self._get_historical_estimate(lat, lng, start, end)
+        if isinstance(result, dict): # error payload
+            return result
+        self._cache_put(key, result, _HISTORICAL_TTL)
+        return [dict(day) for day in result]
 
     def _get_forecast_data(self, lat, lng, start, end):
         """Retrieve forecast data from Open-Meteo API"""
         params = {
             "latitude": lat,
             "longitude": lng,
-            "start_date": start.strftime("%Y-%m-%d"),
-            "end_date": end.strftime("%Y-%m-%d"),
+            "start_date": start.date().isoformat(),
+            "end_date": end.date().isoformat(),
             "daily": ["temperature_2m_max", "temperature_2m_min", "precipitation_sum", "wind_speed_10m_max", "precipitation_probability_mean", "uv_index_max"],
             "timezone": "auto"
         }
         try:
-            response = requests.get(self.forecast_url, params=params)
+            response = self._session.get(self.forecast_url, params=params, timeout=10)
             response.raise_for_status()
-            data = response.json()
+            data = json_loads(response.content)
             return self._format_weather_data(data)
-        except requests.RequestException as e:
+        except (requests.RequestException, ValueError) as e:
             print(f"Error fetching forecast data: {e}")
             return {"error": "Unable to fetch forecast data"}
 
     def _get_historical_estimate(self, lat, lng, start, end):
         """Estimate future weather based on historical data"""
-        historical_data = []
         # Get historical data from past years, ensuring we only request data that's actually in the past
         today = datetime.now().date()
+        requests_by_year = []
         for year_offset in range(1, 5):
             past_start = start - timedelta(days=365 * year_offset)
             past_end = end - timedelta(days=365 * year_offset)
@@ -104,91 +203,111 @@ class WeatherService:
             params = {
                 "latitude": lat,
                 "longitude": lng,
-                "start_date": past_start.strftime("%Y-%m-%d"),
-                "end_date": past_end.strftime("%Y-%m-%d"),
+                "start_date": past_start.date().isoformat(),
+                "end_date": past_end.date().isoformat(),
                 "daily": ["temperature_2m_max", "temperature_2m_min", "precipitation_sum", "wind_speed_10m_max"],
                 "timezone": "auto"
             }
-            try:
-                response = requests.get(self.historical_url, params=params)
-                response.raise_for_status()
-                data = response.json()
-                historical_data.append(data)
-            except requests.RequestException as e:
-                print(f"Error fetching historical data for {past_start.year}: {e}")
-                continue
+            requests_by_year.append((past_start.year, params))
+
+        if not requests_by_year:
+            return {"error": "Unable to fetch sufficient historical data"}
+
+        # The yearly requests are independent; fetch them concurrently, keeping year order
+        with ThreadPoolExecutor(max_workers=len(requests_by_year)) as pool:
+            results = pool.map(lambda job: self._fetch_historical_year(*job), requests_by_year)
+        historical_data = [data for data in results if data is not None]
 
         if not historical_data:
             return {"error": "Unable to fetch sufficient historical data"}
 
         return self._average_historical_data(historical_data)
 
+    def _fetch_historical_year(self, year, params):
+        """Fetch one year's archive data; returns None on failure"""
+        try:
+            if ijson is None:
+                response = self._session.get(self.historical_url, params=params, timeout=10)
+                response.raise_for_status()
+                return json_loads(response.content)
+
+            # Parse straight off the socket; metadata fields are skipped rather than materialized
+            with self._session.get(self.historical_url, params=params, timeout=10, stream=True) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True # let urllib3 undo gzip/deflate
+                return {"daily": dict(ijson.kvitems(response.raw, "daily", use_float=True))}
+        except (requests.RequestException, Urllib3Error) + JSON_ERRORS as e:
+            print(f"Error fetching historical data for {year}: {e}")
+            return None
+
     def _format_weather_data(self, data):
         """Format weather data into a user-friendly structure"""
-        formatted_data = []
         daily = data.get("daily", {})
         dates = daily.get("time", [])
-        max_temps = daily.get("temperature_2m_max", [])
-        min_temps = daily.get("temperature_2m_min", [])
-        precipitations = daily.get("precipitation_sum", [])
-        wind_speeds = daily.get("wind_speed_10m_max", [])
-        precip_probabilities = daily.get("precipitation_probability_mean", [])
-        uv_indices = daily.get("uv_index_max", [])
-
-        for i in range(len(dates)):
-            formatted_data.append({
-                "date": dates[i],
-                "max_temp": f"{max_temps[i]} °C",
-                "min_temp": f"{min_temps[i]} °C",
-                "precipitation": f"{precipitations[i]} mm",
-                "wind_speed": f"{wind_speeds[i]} km/h" if i < len(wind_speeds) else None,
-                "precipitation_probability": f"{precip_probabilities[i]}%" if i < len(precip_probabilities) else None,
-                "uv_index": f"{uv_indices[i]}" if i < len(uv_indices) else None
-            })
-
-        return formatted_data
+        # Pad the optional series with None and stop at the last date
+        rows = islice(zip_longest(
+            dates,
+            daily.get("temperature_2m_max", []),
+            daily.get("temperature_2m_min", []),
+            daily.get("precipitation_sum", []),
+            daily.get("wind_speed_10m_max", []),
+            daily.get("precipitation_probability_mean", []),
+            daily.get("uv_index_max", []),
+        ), len(dates))
+
+        return [
+            {
+                "date": date,
+                "max_temp": f"{max_temp} °C",
+                "min_temp": f"{min_temp} °C",
+                "precipitation": f"{precipitation} mm",
+                "wind_speed": f"{wind_speed} km/h" if wind_speed is not None else None,
+                "precipitation_probability": f"{precip_probability}%" if precip_probability is not None else None,
+                "uv_index": f"{uv_index}" if uv_index is not None else None
+            }
+            for date, max_temp, min_temp, precipitation, wind_speed, precip_probability, uv_index in rows
+        ]
 
     def _average_historical_data(self, historical_data):
         """Calculate average weather metrics from historical data"""
-        aggregated_data = {}
-        count = 0
-
+        # Struct-of-arrays: one (days x metrics) block per response, summed per date with np.add.at
+        date_rows = defaultdict(count().__next__) # date -> output row, assigned in first-seen order
+        blocks, rows = [], []
         for data in historical_data:
             daily = data.get("daily", {})
             dates = daily.get("time", [])
-            max_temps = daily.get("temperature_2m_max", [])
-            min_temps = daily.get("temperature_2m_min", [])
-            precipitations = daily.get("precipitation_sum", [])
-            wind_speeds = daily.get("wind_speed_10m_max", [])
-
-            for i in range(len(dates)):
-                date = dates[i]
-                if date not in aggregated_data:
-                    aggregated_data[date] = {
-                        "max_temp": 0,
-                        "min_temp": 0,
-                        "precipitation": 0,
-                        "wind_speed": 0,
-                        "count": 0
-                    }
-                aggregated_data[date]["max_temp"] += max_temps[i]
-                aggregated_data[date]["min_temp"] += min_temps[i]
-                aggregated_data[date]["precipitation"] += precipitations[i]
-                if i < len(wind_speeds):
-                    aggregated_data[date]["wind_speed"] += wind_speeds[i]
-                aggregated_data[date]["count"] += 1
-
-        averaged_data = []
-        for date, values in aggregated_data.items():
-            averaged_data.append({
-                "date": date,
-                "max_temp": f"{values['max_temp'] / values['count']:.1f} °C",
-                "min_temp": f"{values['min_temp'] / values['count']:.1f} °C",
-                "precipitation": f"{values['precipitation'] / values['count']:.1f} mm",
-                "wind_speed": f"{values['wind_speed'] / values['count']:.1f} km/h",
-            })
+            n = len(dates)
+            block = np.full((n, len(_HISTORICAL_METRICS)), np.nan)
+            for col, metric in enumerate(_HISTORICAL_METRICS):
+                values = np.array(daily.get(metric, [])[:n], dtype=float) # None -> nan
+                block[:len(values), col] = values
+                if metric == "wind_speed_10m_max":
+                    block[len(values):, col] = 0 # days past the end of the wind series count as 0
+            blocks.append(block)
+            rows.append([date_rows[date] for date in dates])
+
+        if not date_rows:
+            return []
+        block = np.concatenate(blocks)
+        row_index = np.concatenate([np.asarray(r, dtype=np.intp) for r in rows])
+        valid = ~np.isnan(block)
+        sums = np.zeros((len(date_rows), len(_HISTORICAL_METRICS)))
+        counts = np.zeros_like(sums)
+        np.add.at(sums, row_index, np.where(valid, block, 0))
+        np.add.at(counts, row_index, valid)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / counts
 
-        return averaged_data
+        return [
+            {
+                "date": date,
+                "max_temp": f"{max_temp:.1f} °C",
+                "min_temp": f"{min_temp:.1f} °C",
+                "precipitation": f"{precipitation:.1f} mm",
+                "wind_speed": f"{wind_speed:.1f} km/h",
+            }
+            for date, (max_temp, min_temp, precipitation, wind_speed) in zip(date_rows, means.tolist())
+        ]
         
     def test_get_weather(self):
         """Test the get_weather method with real API call"""
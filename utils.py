@@ -1,13 +1,217 @@
+import functools
 import os
 from openai import OpenAI
 from typing import Optional, Dict, Any, Union
 from langchain_openai import ChatOpenAI
 import json
 import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import dotenv
 
+try:
+    import orjson # Optional: much faster JSON parsing/serialization for cache files
+except ImportError:
+    orjson = None
+
+try:
+    import ujson # Optional: faster than stdlib for parsing when orjson is missing
+except ImportError:
+    ujson = None
+
+try:
+    import ijson # Optional: streaming parser the API services use for large responses
+except ImportError:
+    ijson = None
+
+# json, orjson and ujson decode errors all subclass ValueError; ijson raises its own
+JSON_ERRORS = (ValueError,) + ((ijson.JSONError,) if ijson else ())
+
 dotenv.load_dotenv()
 
+
+def json_loads(data: Union[bytes, str]) -> Any:
+    """Parse JSON from bytes or str, preferring orjson, then ujson, then stdlib json."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if ujson is not None:
+        return ujson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj: Any, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode('utf-8')
+
+
+def load_json_file(path: str) -> Any:
+    """Read and parse a JSON file in one binary read."""
+    with open(path, 'rb') as f:
+        return json_loads(f.read())
+
+
+def atomic_write_bytes(path: str, payload: bytes) -> None:
+    """
+    Replace the file at path with payload so readers never see a partial write:
+    write a temp file in the same directory, fsync it, then os.replace it into place.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def dump_json_lines(path: str, objs, append: bool = False) -> None:
+    """Write one JSON document per line; appends in place, full rewrites are atomic."""
+    payload = b"".join(json_dumps(obj) + b"\n" for obj in objs)
+    if not append:
+        atomic_write_bytes(path, payload)
+        return
+    with open(path, 'ab') as f:
+        f.write(payload)
+
+def load_json_lines(path: str, keep=None) -> Dict[Any, Any]:
+    """
+    Replay an append-only {"k": key, "v": value} log into a dict (later lines win).
+    Entries for which keep(value) is false are dropped; if the file holds superseded,
+    dropped or malformed lines it is compacted in place. A missing file gives {}.
+    """
+    cache: Dict[Any, Any] = {}
+    lines = 0
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json_loads(line)
+                    cache[entry["k"]] = entry["v"]
+                except (ValueError, KeyError, TypeError):
+                    continue # skip a torn or malformed line
+    except FileNotFoundError:
+        return cache
+    if keep is not None:
+        cache = {k: v for k, v in cache.items() if keep(v)}
+    if lines > len(cache):
+        try:
+            dump_json_lines(path, ({"k": k, "v": v} for k, v in cache.items()))
+        except OSError as e:
+            print(f"Could not compact {path}: {e}")
+    return cache
+
+
+# Single worker, so background writes land on disk in call order; pending ones finish at interpreter exit
+_background_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-writer")
+
+
+def _write_text(path: str, text: str) -> bool:
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    except OSError as e:
+        print(f"Could not write {path}: {e}")
+        return False
+    return True
+
+
+def write_text_in_background(path: str, text: str):
+    """Write text to path off the caller's thread; returns a Future resolving to whether it succeeded."""
+    return _background_writer.submit(_write_text, path, text)
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after a per-entry time-to-live.
+
+    Expiry is lazy (checked on access) and uses time.monotonic(). When full,
+    the least recently used entry is evicted. Safe to share between threads.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is self._MISSING:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, self._MISSING)
+        return default if item is self._MISSING else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self._MISSING) is not self._MISSING
+
+    def __getitem__(self, key):
+        value = self.get(key, self._MISSING)
+        if value is self._MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __len__(self):
+        return len(self._data)
+
+
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+def get_openai_client() -> OpenAI:
+    """Return the process-wide OpenAI client, creating it on first use.
+
+    The client owns an HTTP connection pool, so reusing it keeps connections warm
+    across calls; it is safe to share between threads.
+    """
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _openai_client
+
+
 # use openai to ask question to get information
 def ask_openai(
     prompt: str,
@@ -17,7 +221,7 @@ def ask_openai(
 ) -> Optional[Dict[str, Any]]:
     
     try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        client = get_openai_client()
         
         # Send request
         response = client.chat.completions.create(
@@ -43,6 +247,12 @@ def ask_openai(
 
 
 
+# Patterns used by extract_number, compiled once
+_NON_NUMERIC_RE = re.compile(r'[^\d.,]')
+_NUMBER_RE = re.compile(r'\d+\.?\d*')
+
+# Pure str -> float parsers; the same LLM answers recur, so memoize them
+@functools.lru_cache(maxsize=4096)
 def extract_number(text: str) -> Optional[float]:
     """
     Extract numbers from text, supporting multiple formats
@@ -72,7 +282,7 @@ def extract_number(text: str) -> Optional[float]:
             pass
         
         # Remove currency symbols and other non-numeric characters (keep numbers, decimal points and commas)
-        text = re.sub(r'[^\d.,]', '', text)
+        text = _NON_NUMERIC_RE.sub('', text)
         
         # Handle different decimal point formats
         if ',' in text and '.' in text:
@@ -83,7 +293,7 @@ def extract_number(text: str) -> Optional[float]:
             text = text.replace(',', '.')
         
         # Extract first number
-        match = re.search(r'\d+\.?\d*', text)
+        match = _NUMBER_RE.search(text)
         if match:
             return float(match.group())
             
@@ -92,6 +302,7 @@ def extract_number(text: str) -> Optional[float]:
     except Exception:
         return None
 
+@functools.lru_cache(maxsize=4096)
 def extract_price(text: str, currency: str = "USD") -> Optional[float]:
     """
     从文本中提取价格，支持多种格式
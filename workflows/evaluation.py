@@ -1,8 +1,10 @@
-import os
-import openai
 import re
-from dotenv import load_dotenv
-load_dotenv()
+from utils import get_openai_client, write_text_in_background
+
+# Patterns for parsing the "score: / comment:" reply, compiled once
+_SCORE_RE = re.compile(r"score[:：]\s*([0-9]{1,2})", re.IGNORECASE)
+_COMMENT_RE = re.compile(r"comment[:：]\s*(.*)", re.IGNORECASE | re.DOTALL)
+
 def evaluate_state_with_llm(state: dict):
     """
     use LLM to evaluate the self.state dictionary content.
@@ -19,7 +21,6 @@ The following is the generated travel plan result:
 ai_recommendation_generated: {state['ai_recommendation_generated']}
 itinerary: {state['itinerary']}
 budget: {state['budget']}
-rental_post: {state['rental_post']}
 should_rent_car: {state['should_rent_car']}
 
 Please evaluate whether the generated travel plan meets the user's needs and preferences.
@@ -30,36 +31,42 @@ comment: <your comment>
 """
     )
 
-    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    client = get_openai_client()
     response = client.chat.completions.create(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are a user."},
             {"role": "user", "content": prompt}
         ],
-        temperature=0.7
+        temperature=0.7,
+        stream=True
     )
-    llm_output = response.choices[0].message.content
+    # Echo tokens as they arrive and collect them for parsing
     print("LLM原始输出：")
-    print(llm_output)
+    parts = []
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            print(delta, end="", flush=True)
+    print()
+    llm_output = "".join(parts)
 
     save_score_and_comment(state,llm_output)
 
 def save_score_and_comment(state,llm_output, filename="evaluation score.txt"):
     # extract score and comment from llm_output
-    score_match = re.search(r"score[:：]\s*([0-9]{1,2})", llm_output, re.IGNORECASE)
-    comment_match = re.search(r"comment[:：]\s*(.*)", llm_output, re.IGNORECASE | re.DOTALL)
+    score_match = _SCORE_RE.search(llm_output)
+    comment_match = _COMMENT_RE.search(llm_output)
 
     score = score_match.group(1) if score_match else "N/A"
     comment = comment_match.group(1).strip() if comment_match else "N/A"
 
-    # save to file
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(f"output: {state}\n")
-        f.write(f"score: {score}\n")
-        f.write(f"comment: {comment}\n")
-
-    print(f"finish evaluation and save to {filename}")
+    # save to file off the caller's thread; the text is built here so later state changes don't leak in
+    write_text_in_background(filename, f"output: {state}\nscore: {score}\ncomment: {comment}\n")
+    print(f"finish evaluation, saving to {filename}")
 
 
 ## 后续需要添加的
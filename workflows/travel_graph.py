@@ -1,101 +1,178 @@
-from agents.chat_agent import ChatAgent
-from agents.information_agent import InformationAgent
-from agents.recommend_agent import RecommendAgent
-from agents.strategy_agent import StrategyAgent
-from agents.route_agent import RouteAgent
-from agents.communication_agent import CommunicationAgent
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+import logging
+import threading
 from datetime import datetime, timedelta
 from langchain.schema import AIMessage
 
-import traceback
+from utils import TTLCache
+
+log = logging.getLogger(__name__)
+
+# Fan-out pool for independent, I/O-bound agent calls (LLM and HTTP) within a step
+_agent_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="travel-graph")
+
+# Session store bounds: least recently used sessions are dropped beyond the cap, idle ones after the TTL
+_MAX_SESSIONS = 1000
+
+# String forms of "true" accepted from request kwargs (form/query values arrive as strings)
+_TRUTHY = frozenset({"true", "True", "TRUE", "1", "yes", "on"})
+
+def _as_bool(value):
+    return value in _TRUTHY if isinstance(value, str) else bool(value)
+
+# Fixed chat messages the UI sends for strategy actions (normalized: lower case, single spaces) -> intent;
+# clients that pass intent= explicitly skip this lookup
+_STRATEGY_INTENTS = {
+    "here are my selected attractions": "confirm_selection",
+}
+
+# State fields returned by the strategy step (the frontend merges whatever keys it receives)
+_STRATEGY_FLAG_STATE_KEYS = ("should_rent_car", "ai_recommendation_generated", "user_input_processed")
+_STRATEGY_PLANNED_STATE_KEYS = ("user_info", "attractions", "daily_plan") + _STRATEGY_FLAG_STATE_KEYS
+
+def _ai_stream(content):
+    """One-message stream in the same shape as the agents' streaming LLM output"""
+    yield AIMessage(content=content)
+
+def _default_state():
+    """Fresh state for a new session; built per call so no nested containers are shared"""
+    return {
+        "user_info": {},
+        "attractions": [], # This will hold LLM-ranked attractions from InfoAgent
+        "weather_summary": None, # To store weather summary string
+        "selected_attractions": [],
+        "additional_attractions": [],
+        "should_rent_car": False, # Ensure this defaults to False
+        "itinerary": [],
+        "budget": {},
+        "ai_recommendation_generated": False, # Flag for strategy AI advice
+    }
+
 # This is a simplified state graph manager since we're not using the actual langgraph library
 class TravelGraph:
-    def __init__(self):
-        self.chat_agent = ChatAgent()
-        self.info_agent = InformationAgent() # InfoAgent now handles LLM re-ranking
-        self.recommend_agent = RecommendAgent() # Still used for map_data, etc.
-        self.strategy_agent = StrategyAgent()
-        self.route_agent = RouteAgent()
-        self.comm_agent = CommunicationAgent()
-        
-        self.state = { # Default state for a new session
-            "user_info": {},
-            "attractions": [], # This will hold LLM-ranked attractions from InfoAgent
-            "weather_summary": None, # To store weather summary string
-            "selected_attractions": [],
-            "additional_attractions": [],
-            "should_rent_car": False, # Ensure this defaults to False
-            # "rental_post": None, # Intentionally removed from state
-            "itinerary": [],
-            "budget": {},
-            "ai_recommendation_generated": False, # Flag for strategy AI advice
+    def __init__(self, session_ttl):
+        # Step name -> handler; every handler takes the session state first
+        self._handlers = {
+            "chat": self._process_chat,
+            "information": self._process_information, # This will now call the updated InfoAgent
+            "recommend": self._process_recommend, # This uses the already LLM-ranked list
+            "strategy": self._process_strategy,
+            "route": self._process_route,
         }
-        self.session_states = {} # To store states for different sessions
+        # session_id -> (state, Lock serializing steps of that session); bounded, and sessions
+        # idle for session_ttl seconds expire (the caller passes its web session lifetime)
+        self.session_states = TTLCache(maxsize=_MAX_SESSIONS, ttl=session_ttl)
+        self._sessions_lock = threading.Lock()
+        # Session used when process_step is called without a session_id (main.py keeps one graph per browser session)
+        self._default_session_id = str(id(self))
+    
+    # Agents are built (and their modules imported) on first use; most sessions never reach every step
+    @cached_property
+    def chat_agent(self):
+        from agents.chat_agent import ChatAgent
+        return ChatAgent()
+    
+    @cached_property
+    def info_agent(self):
+        from agents.information_agent import InformationAgent
+        return InformationAgent() # InfoAgent now handles LLM re-ranking
+    
+    @cached_property
+    def recommend_agent(self):
+        from agents.recommend_agent import RecommendAgent
+        return RecommendAgent() # Still used for map_data, etc.
+    
+    @cached_property
+    def strategy_agent(self):
+        from agents.strategy_agent import StrategyAgent
+        return StrategyAgent()
+    
+    @cached_property
+    def route_agent(self):
+        from agents.route_agent import RouteAgent
+        return RouteAgent(info_agent=self.info_agent) # share one set of API clients/sessions
+    
+    @cached_property
+    def comm_agent(self):
+        from agents.communication_agent import CommunicationAgent
+        return CommunicationAgent()
+    
+    def _get_session(self, session_id):
+        """(state, lock) for a session, created on first use; each access restarts its idle timer"""
+        with self._sessions_lock:
+            session = self.session_states.get(session_id)
+            if session is None:
+                session = (_default_state(), threading.Lock())
+            self.session_states[session_id] = session # (re)insert: sliding expiry
+            return session
     
     def get_session_state(self, session_id):
-        if session_id not in self.session_states:
-            # Create a new state by copying the default state structure
-            self.session_states[session_id] = {
-                "user_info": {}, "attractions": [], "weather_summary": None,
-                "selected_attractions": [], "additional_attractions": [],
-                "should_rent_car": False, # Ensure this defaults to False
-                # "rental_post": None, # Intentionally removed from state
-                "itinerary": [], "budget": {},
-                "ai_recommendation_generated": False,
-            }
-        return self.session_states[session_id]
+        return self._get_session(session_id)[0]
+    
+    @staticmethod
+    def _set_attractions(state, attractions):
+        """Store the attraction list together with its id and name indexes; returns the id index"""
+        state["attractions"] = attractions
+        state.pop("_info_fingerprint", None) # the list no longer is the information step's ranking as such
+        state["_attractions_by_id"] = {a["id"]: a for a in attractions if a and a.get("id")}
+        state["_spots_by_name"] = {a["name"]: a for a in attractions if a and "name" in a} # daily plans refer to spots by name
+        return state["_attractions_by_id"]
+    
+    def _map_data_for(self, state, attractions):
+        """Map markers for an attraction list, memoized per session on the list's ids"""
+        key = tuple(a.get("id") for a in attractions)
+        map_cache = state.setdefault("_map_cache", {})
+        map_data = map_cache.get(key)
+        if map_data is None:
+            if len(map_cache) >= 8: # only the last few lists are ever re-requested
+                map_cache.clear()
+            map_data = map_cache[key] = self.recommend_agent.generate_map_data(attractions)
+        return map_data
+    
+    @staticmethod
+    def _state_view(state, keys):
+        """Partial state for responses that only touch a few fields"""
+        return {k: state[k] for k in keys if k in state}
+    
+    @staticmethod
+    def _public_state(state):
+        """Copy of the state for responses, without internal ("_"-prefixed) bookkeeping keys"""
+        return {k: v for k, v in state.items() if not k.startswith("_")}
     
     def process_step(self, step_name, session_id=None, **kwargs):
         # print(f"[DEBUG] Processing step {step_name} for session_id: {session_id}")
         # print(f"[DEBUG] Initial kwargs: {kwargs}")
         
-        if session_id:
-            self.state = self.get_session_state(session_id)
-            # print(f"[DEBUG] Retrieved session state: {self.state}")
-        else:
-            session_id = str(id(self)) # Fallback if no session_id, though it should be provided
-            self.state = self.get_session_state(session_id)
-            print(f"[WARN] No session_id provided, created fallback session: {session_id}")
-        
-        if 'ai_recommendation_generated' in kwargs: # Ensure flag is a boolean
-            self.state['ai_recommendation_generated'] = str(kwargs['ai_recommendation_generated']).lower() == 'true'
-        
-        # print(f"[DEBUG] State before processing {step_name}: {self.state}")
+        if not session_id:
+            session_id = self._default_session_id # Fallback if no session_id, though it should be provided
+            log.warning("No session_id provided, using fallback session: %s", session_id)
+        # The state dict is passed explicitly to each step and mutated in place, so no copy-back is needed
+        # and steps for different sessions never touch each other's state
+        state, session_lock = self._get_session(session_id)
         
-        result = {}
-        if step_name == "chat":
-            result = self._process_chat(**kwargs)
-        elif step_name == "information":
-            result = self._process_information(**kwargs) # This will now call the updated InfoAgent
-        elif step_name == "recommend":
-            result = self._process_recommend(**kwargs) # This uses the already LLM-ranked list
-        elif step_name == "strategy":
-            result = self._process_strategy(**kwargs)
-        elif step_name == "route":
-            result = self._process_route(**kwargs)
-        elif step_name == "communication":
-            result = self._process_communication(**kwargs)
-        else:
-            result = {"error": f"Unknown step: {step_name}"}
+        with session_lock:
+            # print(f"[DEBUG] State before processing {step_name}: {state}")
+            
+            handler = self._handlers.get(step_name)
+            result = handler(state, **kwargs) if handler else {"error": f"Unknown step: {step_name}"}
         
-        self.session_states[session_id] = self.state.copy() # Save a copy of the modified state
         result["session_id"] = session_id # Ensure session_id is always in the result
-        # print(f"[DEBUG] State after processing {step_name}: {self.state}")
+        # print(f"[DEBUG] State after processing {step_name}: {state}")
         # print(f"[DEBUG] Result for {step_name}: {result}")
         return result
     
-    def _process_chat(self, user_input=None, **kwargs):
-        current_user_info = self.state.get("user_info", {}).copy() # Important to work with a copy for updates
+    def _process_chat(self, state, user_input=None, **kwargs):
+        current_user_info = state.get("user_info", {}).copy() # Important to work with a copy for updates
         chat_result = self.chat_agent.collect_info(user_input or "", current_user_info)
         
         if chat_result.get("state"):
-            self.state["user_info"].update(chat_result["state"])
-            # print(f"[DEBUG] Updated user_info in _process_chat: {self.state['user_info']}")
-            # Remove rental_post from state if it was ever set here, though unlikely for chat
-            # self.state.pop("rental_post", None)
+            state["user_info"].update(chat_result["state"])
+            self._prefetch_geocode(state)
+            # print(f"[DEBUG] Updated user_info in _process_chat: {state['user_info']}")
 
         response_data = {
-            "state": self.state.copy(), # Return a fresh copy of the current state
+            "state": self._public_state(state), # Return a fresh copy of the current state
             "stream": chat_result.get("stream"),
             "missing_fields": chat_result.get("missing_fields", [])
         }
@@ -105,22 +182,65 @@ class TravelGraph:
             return response_data
             
         # If chat is complete, automatically proceed to information gathering
-        # The state (self.state) is already updated, _process_information will use it.
-        info_step_result = self._process_information() 
+        # The state is already updated in place, _process_information will use it.
+        info_step_result = self._process_information(state) 
         return info_step_result # This result will contain next_step, stream, data, and state
     
-    def _process_information(self, **kwargs):
-        user_prefs = self.state["user_info"]
+    def _prefetch_geocode(self, state):
+        """Start geocoding the city as soon as chat has collected it, so the information step finds it ready"""
+        city = state["user_info"].get("city")
+        prefetch = state.get("_geocode_prefetch")
+        if city and (prefetch is None or prefetch[0] != city):
+            state["_geocode_prefetch"] = (city, _agent_pool.submit(self.info_agent.city2geocode, city))
+    
+    @staticmethod
+    def _info_fingerprint(user_prefs):
+        """Everything the information step's output depends on: the ranking preferences plus the weather window"""
+        from agents.information_agent import RANKING_PREF_KEYS
+        return repr([user_prefs.get(k) for k in ("start_date",) + RANKING_PREF_KEYS])
+    
+    def _information_response(self, state, city, include_map_data=True):
+        if state["attractions"]:
+            info_message = f"I've prepared a personalized list of {len(state['attractions'])} attractions in {city} for you, considering your preferences and the weather. Please take a look and select your favorites."
+        else:
+            info_message = f"I couldn't find attractions in {city} matching your preferences right now. You might want to try different criteria or another city."
+        
+        return {
+            "next_step": "recommend",
+            "stream": _ai_stream(info_message),
+            "attractions": state["attractions"], # This list is now LLM-ranked
+            "map_data": self._map_data_for(state, state["attractions"]) if include_map_data else None, # recommend_agent helps with map data
+            "state": self._public_state(state)
+        }
+    
+    def _process_information(self, state, include_map_data=True, **kwargs):
+        user_prefs = state["user_info"]
         city = user_prefs.get("city")
 
         if not city:
-            def error_gen(): yield AIMessage(content="Please tell me which city you'd like to visit.")
-            return {"next_step": "chat", "stream": error_gen(), "missing_fields": ["city"], "state": self.state.copy()}
+            return {"next_step": "chat", "stream": _ai_stream("Please tell me which city you'd like to visit."), "missing_fields": ["city"], "state": self._public_state(state)}
+
+        # A chat update that changed nothing the ranking depends on (e.g. a corrected name) keeps the current list
+        if state["attractions"] and state.get("_info_fingerprint") == self._info_fingerprint(user_prefs):
+            log.debug("Information inputs unchanged for '%s'; reusing %s ranked attractions.", city, len(state["attractions"]))
+            return self._information_response(state, city, _as_bool(include_map_data))
 
-        city_coordinates = self.info_agent.city2geocode(city)
+        prefetch = state.pop("_geocode_prefetch", None)
+        if prefetch and prefetch[0] == city:
+            city_coordinates = prefetch[1].result() # usually already resolved during the chat turns
+        else:
+            city_coordinates = self.info_agent.city2geocode(city)
         if not city_coordinates:
-            def error_gen(): yield AIMessage(content=f"Sorry, I couldn't find coordinates for {city}.")
-            return {"next_step": "chat", "stream": error_gen(), "state": self.state.copy()}
+            return {"next_step": "chat", "stream": _ai_stream(f"Sorry, I couldn't find coordinates for {city}."), "state": self._public_state(state)}
+        
+        # Nearby places + details don't depend on the weather; fetch them while the summary is produced
+        candidates_future = _agent_pool.submit(
+            self.info_agent.fetch_attraction_candidates,
+            city_coordinates["lat"],
+            city_coordinates["lng"],
+            poi_type="tourist_attraction"
+            # sort_by="rating" # Initial sort before LLM
+        )
         
         # Get weather summary first
         weather_summary_str = None
@@ -145,52 +265,37 @@ class TravelGraph:
                         weather_summary_str = summary_val.content
                     elif isinstance(summary_val, str):
                         weather_summary_str = summary_val
-                    self.state["weather_summary"] = weather_summary_str
-                    print(f"[DEBUG] Weather summary set in state: '{weather_summary_str}'")
+                    state["weather_summary"] = weather_summary_str
+                    log.debug("Weather summary set in state: '%s'", weather_summary_str)
                 else:
-                    print(f"[DEBUG] Weather summary not found or in unexpected format: {weather_data_result}")
+                    log.debug("Weather summary not found or in unexpected format: %s", weather_data_result)
             except ValueError:
-                print(f"[ERROR] Invalid 'days' for weather: {user_days_str}")
-            except Exception as e:
-                print(f"[ERROR] Exception fetching weather summary: {e}")
-                traceback.print_exc()
+                log.error("Invalid 'days' for weather: %s", user_days_str)
+            except Exception:
+                log.exception("Exception fetching weather summary")
         else:
-            print("[DEBUG] Weather info not fetched (no days).")
+            log.debug("Weather info not fetched (no days).")
             
-        # Get attractions - InfoAgent now handles LLM re-ranking internally
-        print(f"[DEBUG] Calling info_agent.get_attractions for '{city}' with user_prefs and weather.")
-        attractions_from_info_agent = self.info_agent.get_attractions(
-            lat=city_coordinates["lat"],
-            lng=city_coordinates["lng"],
+        # Rank attractions - InfoAgent handles LLM re-ranking against preferences and weather
+        log.debug("Ranking attractions for '%s' with user_prefs and weather.", city)
+        attractions_from_info_agent = self.info_agent.rank_attractions(
+            candidates_future.result(),
             user_prefs=user_prefs, # Pass full user_prefs
-            weather_summary=self.state.get("weather_summary"), # Pass fetched weather summary
-            number=20, # Desired number of top attractions after LLM ranking
-            poi_type="tourist_attraction"
-            # sort_by="rating" # Initial sort inside get_attractions before LLM
+            weather_summary=state.get("weather_summary"), # Pass fetched weather summary
+            number=20 # Desired number of top attractions after LLM ranking
         )
         
-        self.state["attractions"] = attractions_from_info_agent if attractions_from_info_agent else []
-        print(f"[DEBUG] attractions state updated with {len(self.state['attractions'])} LLM-ranked items.")
+        self._set_attractions(state, attractions_from_info_agent if attractions_from_info_agent else [])
+        state["_info_fingerprint"] = self._info_fingerprint(user_prefs) # after start_date may have been filled in above
+        log.debug("attractions state updated with %s LLM-ranked items.", len(state['attractions']))
         
-        def info_gen_message():
-            if self.state["attractions"]:
-                yield AIMessage(content=f"I've prepared a personalized list of {len(self.state['attractions'])} attractions in {city} for you, considering your preferences and the weather. Please take a look and select your favorites.")
-            else:
-                yield AIMessage(content=f"I couldn't find attractions in {city} matching your preferences right now. You might want to try different criteria or another city.")
-        
-        return {
-            "next_step": "recommend",
-            "stream": info_gen_message(),
-            "attractions": self.state["attractions"], # This list is now LLM-ranked
-            "map_data": self.recommend_agent.generate_map_data(self.state["attractions"]), # recommend_agent helps with map data
-            "state": self.state.copy()
-        }
+        return self._information_response(state, city, _as_bool(include_map_data))
     
-    def _process_recommend(self, selected_attraction_ids=None, **kwargs):
+    def _process_recommend(self, state, selected_attraction_ids=None, include_map_data=True, **kwargs):
         """Process recommend agent step"""
         try:
-            user_prefs = self.state["user_info"]
-            attractions = self.state["attractions"]
+            user_prefs = state["user_info"]
+            attractions = state["attractions"]
             
             
             # Check if we have selected_attraction_ids in kwargs
@@ -198,20 +303,19 @@ class TravelGraph:
                 selected_attraction_ids = kwargs['selected_attraction_ids']
             
             if selected_attraction_ids:
-                # User has selected specific attractions
+                # User has selected specific attractions; look them up by id (in selection order, deduplicated)
+                attractions_by_id = state.get("_attractions_by_id")
+                if attractions_by_id is None:
+                    attractions_by_id = self._set_attractions(state, attractions)
                 selected_attractions = [
-                    a for a in attractions 
-                    if a and a.get("id") and a["id"] in selected_attraction_ids
+                    attractions_by_id[a_id] for a_id in dict.fromkeys(selected_attraction_ids)
+                    if a_id in attractions_by_id
                 ]
-                self.state["selected_attractions"] = selected_attractions
-                
-                # Create a generator that yields a transition message
-                def transition_generator():
-                    yield AIMessage(content="Processing your selected attractions...")
+                state["selected_attractions"] = selected_attractions
                 
                 return {
                     "next_step": "strategy",
-                    "stream": transition_generator(),
+                    "stream": _ai_stream("Processing your selected attractions..."),
                     "selected_attractions": selected_attractions
                 }
             else:
@@ -227,18 +331,14 @@ class TravelGraph:
                 
                 recommended = self.recommend_agent.recommend_core_attractions(user_prefs, attractions,)
                 
-                # Create a generator that yields the recommendation message
-                def recommendation_generator():
-                    yield AIMessage(content="Here are some recommended attractions for you.")
-                
                 return {
                     "next_step": "recommend",  # Stay on this step until user selects attractions
-                    "stream": recommendation_generator(),
+                    "stream": _ai_stream("Here are some recommended attractions for you."),
                     "recommended_attractions": recommended,
-                    "map_data": self.recommend_agent.generate_map_data(recommended)
+                    "map_data": self._map_data_for(state, recommended) if _as_bool(include_map_data) else None
                 }
         except Exception as e:
-            print(f"Error in _process_recommend: {str(e)}")
+            log.exception("Error in _process_recommend")
             return {
                 "next_step": "error",
                 "stream": None,
@@ -246,205 +346,146 @@ class TravelGraph:
                 "error": str(e)
             }
     
-    def _process_strategy(self, **kwargs):
+    def _process_strategy(self, state, intent=None, **kwargs):
         """Process strategy agent step"""
-        # Check if this is a confirm selection request or a satisfaction confirmation
-        user_input_lower = kwargs.get('user_input', '').lower()
-        is_confirm_selection = user_input_lower == 'here are my selected attractions'
-        is_satisfaction_confirmation = 'satisfied with your recommendation' in user_input_lower
+        if 'ai_recommendation_generated' in kwargs: # the client echoes the flag back; only this step reads it
+            state['ai_recommendation_generated'] = _as_bool(kwargs['ai_recommendation_generated'])
+        
+        # Check if this is a confirm selection request or a satisfaction confirmation.
+        # The UI sends intent="confirm_selection" from the confirm button; free text falls back to matching the message
+        if intent == "confirm_selection":
+            is_confirm_selection, is_satisfaction_confirmation = True, False
+        elif intent == "satisfaction":
+            is_confirm_selection, is_satisfaction_confirmation = False, True
+        else:
+            user_input_lower = " ".join((kwargs.get('user_input') or '').lower().split())
+            intent = _STRATEGY_INTENTS.get(user_input_lower)
+            is_confirm_selection = intent == "confirm_selection"
+            # The satisfaction reply is prefilled but editable, so it is matched as a phrase inside the text
+            is_satisfaction_confirmation = intent == "satisfaction" or 'satisfied with your recommendation' in user_input_lower
         
         # Log what type of confirmation message we received
         if is_confirm_selection:
-            print("[DEBUG] Received initial confirmation of selections")
+            log.debug("Received initial confirmation of selections")
         elif is_satisfaction_confirmation:
-            print("[DEBUG] Received satisfaction confirmation message")
+            log.debug("Received satisfaction confirmation message")
         else:
-            print(f"[DEBUG] Received other input: '{user_input_lower}'")
+            log.debug("Received other input: '%s'", user_input_lower)
         
         # Print the current state of should_rent_car for debugging
-        if 'should_rent_car' in self.state:
-            print(f"[DEBUG] Current should_rent_car value: {self.state['should_rent_car']}")
+        if 'should_rent_car' in state:
+            log.debug("Current should_rent_car value: %s", state['should_rent_car'])
         else:
-            print("[DEBUG] should_rent_car not yet set in state")
+            log.debug("should_rent_car not yet set in state")
             
         # If recommendations haven't been generated yet and this is the initial confirm selection
-        if not self.state['ai_recommendation_generated'] and is_confirm_selection:
+        if not state['ai_recommendation_generated'] and is_confirm_selection:
             # Update state flags BEFORE generating recommendations
-            self.state['ai_recommendation_generated'] = True
-            self.state['user_input_processed'] = True
+            state['ai_recommendation_generated'] = True
+            state['user_input_processed'] = True
             
-            selected_attractions = self.state["selected_attractions"]
-            total_days = self.state["user_info"].get("days", 1)
+            selected_attractions = state["selected_attractions"]
+            total_days = state["user_info"].get("days", 1)
 
-            # Plan remaining time and suggest additional attractions
-            strategy_result = self.strategy_agent.plan_remaining_time(
+            # The planning and recommendation LLM calls are independent, so run them concurrently.
+            # Plan remaining time and suggest additional attractions (on the pool)
+            strategy_future = _agent_pool.submit(
+                self.strategy_agent.plan_remaining_time,
                 selected_spots=selected_attractions, 
                 total_days=total_days,
-                all_attractions=self.state["attractions"],  ## This should be the full list of attractions
-                user_prefs=self.state["user_info"],    # Pass user_prefs
-                weather_summary=self.state.get("weather_summary") # Pass weather_summary
+                all_attractions=state["attractions"],  ## This should be the full list of attractions
+                user_prefs=dict(state["user_info"]),    # Snapshot: get_ai_recommendation writes should_rent_car into user_info
+                weather_summary=state.get("weather_summary") # Pass weather_summary
             )
-            
-            self.state["attractions"] = strategy_result["additional_attractions"]  ## 现在这里的attractions 是经过筛选的,也是最终的attractions
-            self.state["daily_plan"] = strategy_result.get("daily_plan", {}) # Store the daily plan
 
             # Initialize should_rent_car to False by default
-            self.state["should_rent_car"] = False
-            print("[DEBUG] Initialized should_rent_car to False")
+            state["should_rent_car"] = False
+            log.debug("Initialized should_rent_car to False")
             
-            # Get AI recommendation about the overall plan
+            # Get AI recommendation about the overall plan (on this thread)
             # This will also analyze the recommendation and update should_rent_car in user_prefs
             ai_recommendation = self.strategy_agent.get_ai_recommendation(
-                user_prefs=self.state["user_info"],
+                user_prefs=state["user_info"],
                 selected_spots=selected_attractions,
                 total_days=total_days,
             )
+            strategy_result = strategy_future.result()
+            
+            self._set_attractions(state, strategy_result["additional_attractions"])  ## 现在这里的attractions 是经过筛选的,也是最终的attractions
+            state["daily_plan"] = strategy_result.get("daily_plan", {}) # Store the daily plan
             
             # Get the should_rent_car value from user_prefs after AI recommendation analysis
             # This value is set by extract_rental_recommendation in strategy_agent.py
-            ai_should_rent_car = self.state["user_info"].get("should_rent_car", False)
-            self.state["should_rent_car"] = ai_should_rent_car
+            ai_should_rent_car = state["user_info"].get("should_rent_car", False)
+            state["should_rent_car"] = ai_should_rent_car
             
-            print(f"[CRITICAL] AI rental recommendation set should_rent_car to: {ai_should_rent_car}")
-            print(f"[DEBUG] Updated state should_rent_car value: {self.state['should_rent_car']}")
+            log.info("AI rental recommendation set should_rent_car to: %s", ai_should_rent_car)
+            log.debug("Updated state should_rent_car value: %s", state['should_rent_car'])
             
-            # Create a copy of the state to return
-            state_copy = self.state.copy()
+            # Return only what this step changed; the client keeps its earlier copy of the rest
+            state_copy = self._state_view(state, _STRATEGY_PLANNED_STATE_KEYS)
             
             return {
                 "next_step": "strategy",
                 "stream": ai_recommendation,
                 "remaining_hours": strategy_result["remaining_hours"],
                 "additional_attractions": strategy_result["additional_attractions"],
-                "should_rent_car": self.state["should_rent_car"],
+                "should_rent_car": state["should_rent_car"],
                 "state": state_copy,
                 "ai_recommendation_generated": True,
                 "user_input_processed": True
             }
         # Handle both cases: either we have already generated recommendations 
         # or this is a satisfaction confirmation message
-        elif self.state['ai_recommendation_generated'] or is_satisfaction_confirmation:
-            print("[DEBUG] Recommendations already generated or satisfaction confirmed, moving to next step")
+        elif state['ai_recommendation_generated'] or is_satisfaction_confirmation:
+            log.debug("Recommendations already generated or satisfaction confirmed, moving to next step")
             
             # Check if this is a satisfaction confirmation message and we need to process it specially
-            if is_satisfaction_confirmation and not self.state['ai_recommendation_generated']:
-                print("[CRITICAL] Handling satisfaction confirmation without prior recommendation generation")
+            if is_satisfaction_confirmation and not state['ai_recommendation_generated']:
+                log.info("Handling satisfaction confirmation without prior recommendation generation")
                 # This means user sent satisfaction message before going through normal flow
                 # We need to ensure should_rent_car is correctly set to false in this case
-                self.state["should_rent_car"] = False # Ensure it's false
-                print("[DEBUG] Set should_rent_car to False for satisfaction message without prior recommendation")
+                state["should_rent_car"] = False # Ensure it's false
+                log.debug("Set should_rent_car to False for satisfaction message without prior recommendation")
             
             # ALWAYS GO TO ROUTE STEP, SKIP COMMUNICATION
             next_step = "route"
-            print(f"[CRITICAL] Decision point: Forcing next_step to '{next_step}' to skip car rental communication.")
-            
-            # Create a generator that yields the transition message
-            def transition_generator():
-                if next_step == "route":
-                    yield AIMessage(content="Moving to route planning...")
-                else:
-                    yield AIMessage(content="Moving to car rental options...")
+            log.info("Decision point: Forcing next_step to '%s' to skip car rental communication.", next_step)
             
-            # Create a copy of the state to return
-            state_copy = self.state.copy()
+            # Only the flags can have changed on this path
+            state_copy = self._state_view(state, _STRATEGY_FLAG_STATE_KEYS)
             
             return {
                 "next_step": next_step,
-                "stream": transition_generator(),
+                "stream": _ai_stream("Moving to route planning..." if next_step == "route" else "Moving to car rental options..."),
                 "state": state_copy,
                 "ai_recommendation_generated": True,
                 "user_input_processed": True
             }
         else:
-            print("[DEBUG] Not a confirm selection request and recommendations not generated yet")
-            # Create a generator that yields a message asking for confirmation
-            def confirmation_generator():
-                yield AIMessage(content="Please click the 'Confirm Selection' button to proceed with your travel plan.")
-            
-            # Create a copy of the state to return
-            state_copy = self.state.copy()
-            print(f"[DEBUG] State to be returned: {state_copy}")
+            log.debug("Not a confirm selection request and recommendations not generated yet")
+            # Nothing but the flags is relevant until the selection is confirmed
+            state_copy = self._state_view(state, _STRATEGY_FLAG_STATE_KEYS)
+            log.debug("State to be returned: %s", state_copy)
             
             return {
                 "next_step": "strategy",
-                "stream": confirmation_generator(),
+                "stream": _ai_stream("Please click the 'Confirm Selection' button to proceed with your travel plan."),
                 "state": state_copy,
                 "ai_recommendation_generated": False,
                 "user_input_processed": False
             }
     
-    # After strategy step + self.state.get("should_rent_car", False) == True
-    def _process_communication(self, response_message=None, **kwargs):
-        """Process communication agent step - LOGIC MOSTLY COMMENTED OUT"""
-        # First check if car rental is actually recommended (THIS CHECK IS NOW REDUNDANT as we skip this step)
-        # if not self.state.get("should_rent_car", False):
-        #     # If car rental is NOT recommended, skip to route planning
-        #     def skip_rental_generator():
-        #         yield AIMessage(content="Moving to the route planning step...")
-        #         
-        #     return {
-        #         "next_step": "route",
-        #         "stream": skip_rental_generator(),
-        #     }
-            
-        # if response_message and self.state.get("rental_post"):
-        #     # Handle response to rental post
-        #     reply = self.comm_agent.handle_rental_response(
-        #         self.state["rental_post"],
-        #         response_message
-        #     )
-        #     
-        #     # Create a generator that yields the response message
-        #     def reply_generator():
-        #         yield AIMessage(content="Thank you for handling the car rental.")
-        #     
-        #     return {
-        #         "next_step": "route",  # Move to route planning after rental communication
-        #         "stream": reply_generator(),
-        #         "reply": reply
-        #     }
-        # else:
-        #     # Generate rental post
-        #     location = self.state["user_info"].get("city", "")
-        #     duration = self.state["user_info"].get("days", 1)
-        #     
-        #     rental_post_content = self.comm_agent.post_car_rental_request(
-        #         location,
-        #         duration,
-        #         self.state["user_info"]
-        #     )
-        #     
-        #     self.state["rental_post"] = rental_post_content # Store actual content not the UI representation
-        #     
-        #     # Create a generator that yields the response message
-        #     def response_generator():
-        #         yield AIMessage(content="We recommend renting a car for your trip. I've created a car rental request post for you. Feel free to use it.")
-        #     
-        #     return {
-        #         "next_step": "route",  # Continue with route planning while waiting for responses
-        #         "stream": response_generator(),
-        #         "rental_post": rental_post_content # Return the actual post content
-        #     }
-
-        # Fallback / Default behavior if this step is somehow still called:
-        print("[WARN] _process_communication was called but should be skipped. Proceeding to route planning.")
-        def default_transition_generator():
-            yield AIMessage(content="Proceeding to route planning...")
-        return {
-            "next_step": "route",
-            "stream": default_transition_generator(),
-            "state": self.state.copy()
-        }
-    
-    def _process_route(self, start_date=None, **kwargs):
+    # After strategy step + state.get("should_rent_car", False) == True
+    def _process_route(self, state, start_date=None, **kwargs):
         """Process route agent step"""
         try:
             # Get start date from user preferences, fallback to provided start_date, then to current date
-            start_date = self.state["user_info"].get("start_date") or start_date or datetime.now().strftime("%Y-%m-%d")
+            start_date = state["user_info"].get("start_date") or start_date or datetime.now().strftime("%Y-%m-%d")
             
             
-            all_attractions_objects = self.state["attractions"] ## This is the flat list of all planned attraction objects
-            daily_plan_name_dict = self.state.get("daily_plan") # This is {"day1": ["NameA"], ...}
+            all_attractions_objects = state["attractions"] ## This is the flat list of all planned attraction objects
+            daily_plan_name_dict = state.get("daily_plan") # This is {"day1": ["NameA"], ...}
             
             #print(f"[DEBUG] All attractions: {all_attractions}")
             
@@ -457,71 +498,72 @@ class TravelGraph:
                     "optimal_route": []
                 }
             
-            # Generate itinerary first
-            days = int(self.state["user_info"].get("days", 1))  # Ensure days is an integer
+            days = int(state["user_info"].get("days", 1))  # Ensure days is an integer
 
+            # Parse start_date once; the datetime feeds the itinerary, the string forms feed the rental search
+            start_date_dt = datetime.fromisoformat(start_date) if isinstance(start_date, str) else start_date
+            start_date = start_date_dt.strftime("%Y-%m-%d")
+            end_date = (start_date_dt + timedelta(days=days)).strftime("%Y-%m-%d")
+
+            # The rental and fuel lookups are independent I/O that don't depend on the itinerary;
+            # start both now and build the itinerary while they run
+            should_rent_car = state["should_rent_car"]
+            city = state["user_info"].get("city", "")
+            car_future = fuel_future = None
+            if should_rent_car:
+                car_future = _agent_pool.submit(
+                    self.info_agent.search_car_rentals,
+                    city,
+                    start_date,
+                    end_date,
+                    driver_age=state["user_info"].get("age", 30)
+                )
+                fuel_future = _agent_pool.submit(self.info_agent.get_fuel_price, city)
+
+            # Generate itinerary, and the flat optimal route alongside it
             itinerary = []
+            optimal_route = []
             if daily_plan_name_dict and isinstance(daily_plan_name_dict, dict) and all_attractions_objects:
-                all_spots_map = {spot["name"]: spot for spot in all_attractions_objects if spot and "name" in spot}
+                all_spots_map = state.get("_spots_by_name")
+                if all_spots_map is None:
+                    all_spots_map = {spot["name"]: spot for spot in all_attractions_objects if spot and "name" in spot}
                 itinerary = self.route_agent.format_daily_plan_to_itinerary(
                     daily_plan_name_dict,
                     all_spots_map,
-                    start_date 
+                    start_date_dt,
+                    route=optimal_route
                 )
             else:
-                print("[ERROR] Could not generate itinerary: daily_plan_name_dict or all_attractions_objects missing/invalid.")
+                log.error("Could not generate itinerary: daily_plan_name_dict or all_attractions_objects missing/invalid.")
                 # Fallback: Potentially use the old generate_itinerary if it was kept and makes sense
                 # For now, itinerary remains empty, leading to a response with no itinerary.
-                # self.state["itinerary"] will be empty, and confirmation will reflect that.
+                # state["itinerary"] will be empty, and confirmation will reflect that.
 
-            
-            # Fix: convert start_date to datetime if it's a string
-            if isinstance(start_date, str):
-                start_date_dt = datetime.strptime(start_date, "%Y-%m-%d")
-            else:
-                start_date_dt = start_date
-            end_date = (start_date_dt + timedelta(days=days)).strftime("%Y-%m-%d")
-            # Extract the optimal route from the itinerary
-            optimal_route = []
-            if itinerary:
-                for day_plan_item in itinerary: # Iterate through list of day plans
-                    day_number = day_plan_item.get("day")
-                    for spot in day_plan_item.get("spots", []):
-                        spot_with_day = spot.copy() # Avoid modifying original spot in itinerary
-                        spot_with_day["day"] = day_number
-                        optimal_route.append(spot_with_day)
            
-            # Estimate budget
-
-            if self.state["should_rent_car"]:
-                car_info = self.info_agent.search_car_rentals(
-                    self.state["user_info"].get("city", ""),
-                    start_date,
-                    end_date,
-                    driver_age=self.state["user_info"].get("age", 30)
-                )   
-                fuel_price = self.info_agent.get_fuel_price(self.state["user_info"].get("city", ""))
-                if fuel_price and car_info:
-                    print(f"[DEBUG] Successfully got fuel price and car info, fuel_price: {fuel_price}, car_info: {car_info}")
+            # Estimate budget once the lookups it needs are in
+            car_info = car_future.result() if car_future else None
+            fuel_price = fuel_future.result() if fuel_future else None
+            if fuel_price and car_info:
+                log.debug("Successfully got fuel price and car info, fuel_price: %s, car_info: %s", fuel_price, car_info)
             
             budget = self.route_agent.estimate_budget(
                 all_attractions_objects,
-                self.state["user_info"],
-                self.state["should_rent_car"],
-                car_info if self.state["should_rent_car"] else None,
-                fuel_price if self.state["should_rent_car"] else None
+                state["user_info"],
+                should_rent_car,
+                car_info,
+                fuel_price
             )
        
             # Store in state
-            self.state["itinerary"] = itinerary
-            self.state["budget"] = budget
+            state["itinerary"] = itinerary
+            state["budget"] = budget
             
             # Generate confirmation message
             confirmation = self.comm_agent.generate_booking_confirmation(
                 itinerary,
                 budget,
-                self.state["should_rent_car"],
-                self.state["user_info"].get("name", "Traveler"),
+                state["should_rent_car"],
+                state["user_info"].get("name", "Traveler"),
             )
             
             return {
@@ -534,13 +576,13 @@ class TravelGraph:
             
         except Exception as e:
             # Log the error for debugging
-            print(f"Error in process route: {str(e)}")
+            log.exception("Error in process route")
             return {
                 "next_step": "error",
                 "response": "An error occurred while planning your route. Please try again.",
                 "error": str(e)
             }
     
-    def get_current_state(self):
-        """Get the current state of the workflow"""
-        return self.state
\ No newline at end of file
+    def get_current_state(self, session_id=None):
+        """Get the state of a session (default: the fallback session used when process_step gets no session_id)"""
+        return self._public_state(self.get_session_state(session_id or self._default_session_id))
\ No newline at end of file